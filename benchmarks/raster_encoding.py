@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the raster line encoding in BrotherQLRaster.add_raster_data
+
+Compares the batched encoder (frames -> raster line instructions)
+against the original row by row loop and verifies that both produce
+byte-identical instructions.
+
+Usage:  python benchmarks/raster_encoding.py [--rows ROWS] [--repeat REPEAT]
+"""
+
+from __future__ import print_function
+
+import argparse, random, timeit
+
+import packbits
+from PIL import Image, ImageDraw
+
+from brother_ql.raster import BrotherQLRaster
+
+try:
+    from io import BytesIO
+except: # Py2
+    from cStringIO import StringIO as BytesIO
+
+def legacy_encode_frames(qlr, frames, row_len):
+    """ The row by row loop as it was implemented before the batched encoder """
+    frame_len = len(frames[0])
+    start = 0
+    file_str = BytesIO()
+    while start + row_len <= frame_len:
+        for i, frame in enumerate(frames):
+            row = frame[start:start+row_len]
+            if qlr._compression:
+                row = packbits.encode(row)
+            translen = len(row) # number of bytes to be transmitted
+            if qlr.model.startswith('PT'):
+                file_str.write(b'\x47')
+                file_str.write(bytes([translen%256, translen//256]))
+            else:
+                if len(frames) > 1:
+                    file_str.write(b'\x77\x01' if i == 0 else b'\x77\x02')
+                else:
+                    file_str.write(b'\x67\x00')
+                file_str.write(bytes([translen]))
+            file_str.write(row)
+        start += row_len
+    return file_str.getvalue()
+
+def batched_encode_frames(qlr, frames, row_len):
+    # every run is a new job: start without memoized lines
+    qlr._row_encoders.clear()
+    return qlr._encode_frames(frames, row_len)
+
+def label_image(width, height, seed=0):
+    """ A label-like test image: mostly white with some text-like blocks """
+    rnd = random.Random(seed)
+    im = Image.new('1', (width, height), 1)
+    draw = ImageDraw.Draw(im)
+    for i in range(height // 10):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        draw.rectangle([x, y, x + rnd.randrange(120), y + rnd.randrange(8)], fill=0)
+    return im
+
+def run_case(model, rows, repeat, two_color=False, compress=False):
+    qlr = BrotherQLRaster(model)
+    qlr._compression = compress
+    width = qlr.get_pixel_width()
+    images = [label_image(width, rows, seed=1)]
+    if two_color:
+        images.append(label_image(width, rows, seed=2))
+    frames = [bytes(im.transpose(Image.FLIP_LEFT_RIGHT).tobytes()) for im in images]
+    row_len = width//8
+
+    new = batched_encode_frames(qlr, frames, row_len)
+    old = legacy_encode_frames(qlr, frames, row_len)
+    assert new == old, 'Output differs for {}'.format(model)
+
+    t_old = min(timeit.repeat(lambda: legacy_encode_frames(qlr, frames, row_len), number=1, repeat=repeat))
+    t_new = min(timeit.repeat(lambda: batched_encode_frames(qlr, frames, row_len), number=1, repeat=repeat))
+    name = '{}{}{}'.format(model, ' 2-color' if two_color else '', ' compressed' if compress else '')
+    print('{:28s} {:6d} rows  legacy: {:8.2f} ms  batched: {:8.2f} ms  speedup: {:5.1f}x'.format(
+          name, rows, t_old*1000, t_new*1000, t_old/t_new))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000, help='Number of raster lines per label')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions (the best is reported)')
+    args = parser.parse_args()
+
+    run_case('QL-1050', args.rows, args.repeat)
+    run_case('QL-700', args.rows, args.repeat)
+    run_case('QL-820NWB', args.rows, args.repeat, two_color=True)
+    run_case('PT-P750W', args.rows, args.repeat)
+    run_case('QL-1050', args.rows, args.repeat, compress=True)
+    run_case('QL-820NWB', args.rows, args.repeat, two_color=True, compress=True)
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ available_backends = [
   'pyusb',
   'network',
   'linux_kernel',
+  'emulator',
 ]
 
 def guess_backend(identifier):
@@ -16,6 +17,8 @@ def guess_backend(identifier):
         return 'linux_kernel'
     elif identifier.startswith('tcp://'):
         return 'network'
+    elif identifier.startswith('emulator://'):
+        return 'emulator'
     else:
         raise ValueError('Cannot guess backend for given identifier: %s' % identifier)
     
@@ -34,6 +37,10 @@ def backend_factory(backend_name):
         from . import network      as network_backend
         list_available_devices = network_backend.list_available_devices
         backend_class          = network_backend.BrotherQLBackendNetwork
+    elif backend_name == 'emulator':
+        from . import emulator     as emulator_backend
+        list_available_devices = emulator_backend.list_available_devices
+        backend_class          = emulator_backend.BrotherQLBackendEmulator
     else:
         raise NotImplementedError('Backend %s not implemented.' % backend_name)
 
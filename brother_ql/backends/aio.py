@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""
+asyncio variants of the backends and of :py:func:`brother_ql.backends.helpers.send`
+
+A single event loop can drive many printers concurrently:
+
+* network: asyncio streams
+* linux_kernel: the device file descriptor is watched by the event loop
+* pyusb: the synchronous backend runs in the default executor of the loop
+
+Requires Python 3.5+.
+"""
+
+import asyncio, logging, os, time
+
+from brother_ql.backends import backend_factory
+from brother_ql.backends.helpers import select_backend, new_status, update_status, log_outcome
+
+logger = logging.getLogger(__name__)
+
+# asyncio.get_running_loop() was added in Python 3.7
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+class AsyncBrotherQLBackendGeneric(object):
+    """
+    Base class of the asyncio backends.
+
+    Instances are created with the device specifier and are connected
+    to the device with :py:meth:`open` (or by using them as an async
+    context manager).
+    """
+
+    def __init__(self, device_specifier):
+        self.device_specifier = device_specifier
+
+    async def open(self):
+        raise NotImplementedError()
+
+    async def write(self, data):
+        raise NotImplementedError()
+
+    async def read(self, length=32, timeout=None):
+        """
+        Reads up to `length` bytes from the printer.
+
+        :param float timeout: Seconds to wait for data to arrive (None: wait forever).
+        :returns: The bytes read, empty if nothing was received in time.
+        """
+        raise NotImplementedError()
+
+    async def dispose(self):
+        raise NotImplementedError()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.dispose()
+
+class AsyncBrotherQLBackendNetwork(AsyncBrotherQLBackendGeneric):
+    """
+    BrotherQL backend using a TCP connection (asyncio streams)
+    """
+
+    def __init__(self, device_specifier):
+        """
+        device_specifier: string identifier in the format tcp://host[:port]
+        """
+        super(AsyncBrotherQLBackendNetwork, self).__init__(device_specifier)
+        if device_specifier.startswith('tcp://'):
+            device_specifier = device_specifier[6:]
+        host, _, port = device_specifier.partition(':')
+        self.host = host
+        self.port = int(port) if port else 9100
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def write(self, data):
+        logger.debug('Writing %d bytes.', len(data))
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def read(self, length=32, timeout=None):
+        try:
+            data = await asyncio.wait_for(self.reader.read(length), timeout)
+        except asyncio.TimeoutError:
+            return b''
+        if data: logger.debug('Read %d bytes.', len(data))
+        return data
+
+    async def dispose(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+            if hasattr(writer, 'wait_closed'): # Python 3.7+
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    # the printer reset the connection already
+                    pass
+
+class AsyncBrotherQLBackendLinuxKernel(AsyncBrotherQLBackendGeneric):
+    """
+    BrotherQL backend using the Linux Kernel USB Printer Device Handles,
+    opened in non-blocking mode and watched by the event loop.
+    """
+
+    def __init__(self, device_specifier):
+        """
+        device_specifier: string or os.open(): identifier in the \
+            format file:///dev/usb/lp0 or os.open() raw device handle.
+        """
+        super(AsyncBrotherQLBackendLinuxKernel, self).__init__(device_specifier)
+        if not isinstance(device_specifier, (str, int)):
+            raise NotImplementedError('Currently the printer can be specified either via an appropriate string or via an os.open() handle.')
+        self.dev = None
+
+    async def open(self):
+        if isinstance(self.device_specifier, int):
+            self.dev = self.device_specifier
+            os.set_blocking(self.dev, False)
+        else:
+            path = self.device_specifier
+            if path.startswith('file://'):
+                path = path[7:]
+            self.dev = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+
+    async def _wait(self, add, remove, timeout=None):
+        loop = _get_running_loop()
+        ready = loop.create_future()
+        add(self.dev, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        finally:
+            remove(self.dev)
+
+    async def write(self, data):
+        logger.debug('Writing %d bytes.', len(data))
+        loop = _get_running_loop()
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.dev, view)
+            except BlockingIOError:
+                written = 0
+            view = view[written:]
+            if view:
+                await self._wait(loop.add_writer, loop.remove_writer)
+
+    async def read(self, length=32, timeout=None):
+        loop = _get_running_loop()
+        try:
+            return os.read(self.dev, length)
+        except BlockingIOError:
+            pass
+        try:
+            await self._wait(loop.add_reader, loop.remove_reader, timeout)
+        except asyncio.TimeoutError:
+            return b''
+        try:
+            data = os.read(self.dev, length)
+        except BlockingIOError:
+            return b''
+        if data: logger.debug('Read %d bytes.', len(data))
+        return data
+
+    async def dispose(self):
+        if self.dev is not None:
+            os.close(self.dev)
+            self.dev = None
+
+class AsyncBrotherQLBackendExecutor(AsyncBrotherQLBackendGeneric):
+    """
+    Runs a synchronous backend (e.g. pyusb) in the default executor of the event loop.
+
+    :param backend_class: The synchronous backend class, see :py:func:`brother_ql.backends.backend_factory`.
+    """
+
+    def __init__(self, device_specifier, backend_class):
+        super(AsyncBrotherQLBackendExecutor, self).__init__(device_specifier)
+        self.backend_class = backend_class
+        self.backend = None
+
+    async def _run(self, func, *args):
+        return await _get_running_loop().run_in_executor(None, func, *args)
+
+    async def open(self):
+        self.backend = await self._run(self.backend_class, self.device_specifier)
+
+    async def write(self, data):
+        await self._run(self.backend.write, data)
+
+    async def read(self, length=32, timeout=None):
+        # the synchronous backends don't wait forever
+        return await self._run(self.backend.read, length, 10. if timeout is None else timeout)
+
+    async def dispose(self):
+        if self.backend is not None:
+            await self._run(self.backend.dispose)
+            self.backend = None
+
+def async_backend_factory(backend_name):
+    """
+    :returns: A callable creating an (unopened) asyncio backend instance for a device specifier.
+    """
+    if backend_name == 'network':
+        return AsyncBrotherQLBackendNetwork
+    elif backend_name == 'linux_kernel':
+        return AsyncBrotherQLBackendLinuxKernel
+    else:
+        backend_class = backend_factory(backend_name)['backend_class']
+        return lambda device_specifier: AsyncBrotherQLBackendExecutor(device_specifier, backend_class)
+
+async def async_send(instructions, printer_identifier=None, backend_identifier=None, blocking=True, timeout=10.):
+    """
+    Send instruction bytes to a printer, the asyncio variant of :py:func:`brother_ql.backends.helpers.send`.
+
+    :param instructions: The instructions to be sent to the printer. Either bytes or an iterable
+                         of bytes chunks, as produced by :py:func:`brother_ql.conversion.convert_iter`.
+    :param str printer_identifier: Identifier for the printer.
+    :param str backend_identifier: Can enforce the use of a specific backend.
+    :param bool blocking: Indicates whether the coroutine should wait for the completion of the printing.
+    :param float timeout: The maximum time (in seconds) to wait for the printer to report the completion of the printing.
+    :returns: The same status dictionary as :py:func:`brother_ql.backends.helpers.send`.
+    """
+
+    status = new_status()
+    selected_backend = select_backend(printer_identifier, backend_identifier)
+
+    async with async_backend_factory(selected_backend)(printer_identifier) as printer:
+        start = time.time()
+        if isinstance(instructions, (bytes, bytearray, memoryview)):
+            logger.info('Sending instructions to the printer. Total: %d bytes.', len(instructions))
+            await printer.write(instructions)
+        else:
+            total = 0
+            for chunk in instructions:
+                await printer.write(chunk)
+                total += len(chunk)
+            logger.info('Sent instructions to the printer. Total: %d bytes.', total)
+        status['outcome'] = 'sent'
+        status['timings']['sent'] = time.time() - start
+
+        if not blocking:
+            return status
+        if selected_backend == 'network':
+            """ No need to wait for completion. The network backend doesn't support readback. """
+            return status
+
+        deadline = start + timeout
+        data = b''
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            data += await printer.read(timeout=remaining)
+            if len(data) < 32:
+                continue
+            response, data = data[:32], data[32:]
+            if update_status(status, response, time.time() - start):
+                break
+
+    log_outcome(status)
+    return status
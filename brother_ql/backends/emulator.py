@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+"""
+Backend emulating a Brother QL printer (for testing and benchmarking).
+
+The :py:class:`PrinterEmulator` parses the instructions sent to it,
+simulates the time needed to print the pages and answers with the
+32 byte status messages a real printer sends. Errors can be injected.
+
+The emulator can be used
+
+* as a backend with identifiers like ``emulator://QL-820NWB`` or
+  ``emulator://QL-1060N?speed=0&error_rate=0.1`` (see :py:func:`parse_identifier`),
+* as a stand-in for a network printer via :py:func:`serve_tcp`,
+* as a stand-in for a USB printer device file via :py:func:`serve_pty`.
+
+The command ``brother_ql emulate`` runs the servers.
+"""
+
+from __future__ import unicode_literals
+from builtins import str, bytes
+
+import logging, os, random, select, socket, threading, time
+from collections import deque
+
+try:
+    from urllib.parse import parse_qs
+except ImportError: # Py2
+    from urlparse import parse_qs
+
+from brother_ql.reader import OPCODES, RESP_ERROR_INFORMATION_1_DEF, RESP_ERROR_INFORMATION_2_DEF, \
+                              parse_instructions
+from .generic import BrotherQLBackendGeneric
+
+logger = logging.getLogger(__name__)
+
+#: Print speed (in mm/s) of the models according to their data sheets
+PRINT_SPEEDS = {
+  'QL-500':    50,
+  'QL-550':    50,
+  'QL-560':    90,
+  'QL-570':    90,
+  'QL-580N':   90,
+  'QL-650TD':  90,
+  'QL-700':   150,
+  'QL-710W':  150,
+  'QL-720NW': 150,
+  'QL-800':   148,
+  'QL-810W':  110,
+  'QL-820NWB':110,
+  'QL-1050':  110,
+  'QL-1060N': 110,
+  'PT-P750W':  30,
+  'PT-P900W':  60,
+}
+
+#: Raster lines per mm (the printers have a resolution of 300 dpi along the feed)
+ROWS_PER_MM = 300 / 25.4
+
+#: The bit of the error information bytes 1 and 2 by error name
+ERROR_BITS = {}
+ERROR_BITS.update({name: (8, bit) for bit, name in RESP_ERROR_INFORMATION_1_DEF.items()})
+ERROR_BITS.update({name: (9, bit) for bit, name in RESP_ERROR_INFORMATION_2_DEF.items()})
+
+STATUS_REPLY, STATUS_PRINTING_COMPLETED, STATUS_ERROR, STATUS_PHASE_CHANGE = 0x00, 0x01, 0x02, 0x06
+PHASE_RECEIVING, PHASE_PRINTING = 0x00, 0x01
+
+def parse_identifier(identifier):
+    """
+    Parses an identifier ``emulator://MODEL[?OPTIONS]``.
+    The options are given as a query string, their names and values
+    are the arguments of :py:class:`PrinterEmulator`, e.g.
+    ``emulator://QL-700?media_width=29&speed=0``.
+
+    :returns: A dictionary of keyword arguments for :py:class:`PrinterEmulator`.
+    """
+    if identifier.startswith('emulator://'):
+        identifier = identifier[11:]
+    model, _, query = identifier.partition('?')
+    kwargs = {'model': model or 'QL-700'}
+    for key, values in parse_qs(query).items():
+        value = values[-1]
+        if key in ('media_width', 'media_length', 'seed'):
+            value = int(value)
+        elif key in ('speed', 'error_rate'):
+            value = float(value)
+        elif key != 'error':
+            raise ValueError('Unknown emulator option: {}'.format(key))
+        kwargs[key] = value
+    return kwargs
+
+class PrinterEmulator(object):
+    """
+    Emulates a Brother QL printer on the level of its instruction stream.
+
+    Feed it the data sent to the printer with :py:meth:`feed` and fetch
+    the status messages of the printer with :py:meth:`read`.
+    Printing takes the time a real printer needs for the number of
+    raster lines of the page, scaled by `speed`.
+
+    :param str model: The model to emulate (determines the print speed).
+    :param int media_width: The width of the loaded media in mm.
+    :param int media_length: The length of the loaded media in mm (0 for endless tape).
+    :param float speed: Factor applied to the print speed of the model. 0 prints instantly.
+    :param float error_rate: The probability of a page failing with a random error.
+    :param str error: The name of an error (see :py:data:`ERROR_BITS`) the next page fails with.
+    :param int seed: The seed of the random errors.
+    """
+
+    def __init__(self, model='QL-700', media_width=62, media_length=0, speed=1., error_rate=0., error=None, seed=None):
+        self.model = model
+        self.media_width = media_width
+        self.media_length = media_length
+        self.speed = speed
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._next_error = None
+        if error:
+            self.inject_error(error)
+        #: Counters of the emulated printing
+        self.bytes_received = 0
+        self.pages_printed = 0
+        self.rows_printed = 0
+        self.errors = 0
+        self._buffer = bytearray()
+        self._rows = 0
+        self._failed = False
+        self._busy_until = 0.
+        self._responses = deque()
+        self._lock = threading.Lock()
+
+    def inject_error(self, error):
+        """ Makes the next page fail with the error given by its name (see :py:data:`ERROR_BITS`) """
+        if error not in ERROR_BITS:
+            raise ValueError('Unknown error: {}'.format(error))
+        self._next_error = error
+
+    def row_time(self):
+        """ The time needed to print a raster line in seconds """
+        if not self.speed:
+            return 0.
+        return 1. / (PRINT_SPEEDS.get(self.model, 100) * ROWS_PER_MM * self.speed)
+
+    def status(self, status_type=STATUS_REPLY, phase_type=PHASE_RECEIVING, error=None):
+        """ A status message (32 bytes) of the printer """
+        frame = bytearray(32)
+        frame[0:8] = b'\x80\x20\x42\x34\x30\x30\x30\x00'
+        frame[10] = self.media_width
+        frame[11] = 0x0B if self.media_length else 0x0A
+        frame[17] = self.media_length
+        frame[18] = status_type
+        frame[19] = phase_type
+        if error:
+            byte, bit = ERROR_BITS[error]
+            frame[byte] |= 1 << bit
+        return bytes(frame)
+
+    def _respond(self, at, response):
+        self._responses.append((at, response))
+
+    def feed(self, data):
+        """ Processes data received from the host """
+        with self._lock:
+            self.bytes_received += len(data)
+            self._buffer += data
+            # process the complete instructions, keep an incomplete last one for later
+            end = 0
+            for opcode, offset, length in parse_instructions(self._buffer, partial=True):
+                self._process(OPCODES[opcode][0], self._buffer, offset)
+                end = offset + length
+            del self._buffer[:end]
+
+    def _process(self, name, data, offset):
+        if name == 'init':
+            self._rows = 0
+            self._failed = False
+        elif name == 'status request':
+            self._respond(time.time(), self.status())
+        elif name == 'zero raster' or name in ('raster QL', 'raster P-touch'):
+            self._rows += 1
+        elif name == '2-color raster QL':
+            if data[offset+1] == 0x01:
+                self._rows += 1
+        elif name == 'print':
+            self._print_page()
+
+    def _print_page(self):
+        rows, self._rows = self._rows, 0
+        if self._failed:
+            return
+        start = max(time.time(), self._busy_until)
+        error = self._next_error
+        self._next_error = None
+        if error is None and self.error_rate and self._random.random() < self.error_rate:
+            error = self._random.choice(sorted(ERROR_BITS))
+        if error is not None:
+            # the rest of the job is discarded
+            self._failed = True
+            self.errors += 1
+            self._respond(start, self.status(STATUS_ERROR, PHASE_RECEIVING, error))
+            return
+        done = start + rows * self.row_time()
+        self._busy_until = done
+        self._respond(start, self.status(STATUS_PHASE_CHANGE, PHASE_PRINTING))
+        self._respond(done, self.status(STATUS_PRINTING_COMPLETED, PHASE_PRINTING))
+        self._respond(done, self.status(STATUS_PHASE_CHANGE, PHASE_RECEIVING))
+        self.pages_printed += 1
+        self.rows_printed += rows
+
+    def next_response_time(self):
+        """ The time the next status message is due, None if there is none """
+        with self._lock:
+            return self._responses[0][0] if self._responses else None
+
+    def read(self, length=32):
+        """ The status messages due so far (at most `length` bytes) """
+        now = time.time()
+        data = b''
+        with self._lock:
+            while self._responses and self._responses[0][0] <= now and len(data) + 32 <= length:
+                data += self._responses.popleft()[1]
+        return data
+
+    def wait(self, timeout):
+        """ Sleeps until the next status message is due, but at most `timeout` seconds """
+        due = self.next_response_time()
+        if due is None:
+            time.sleep(timeout)
+        else:
+            time.sleep(min(max(due - time.time(), 0), timeout))
+
+def list_available_devices():
+    """
+    List all available devices for the emulator backend
+
+    returns: devices: an empty list. Emulated printers are not discovered,
+        they are created by using an identifier like emulator://QL-820NWB.
+    """
+    return []
+
+class BrotherQLBackendEmulator(BrotherQLBackendGeneric):
+    """
+    BrotherQL backend talking to a :py:class:`PrinterEmulator`
+    """
+
+    def __init__(self, device_specifier):
+        """
+        device_specifier: string identifier in the format emulator://MODEL[?OPTIONS]
+            (see :py:func:`parse_identifier`) or a PrinterEmulator instance.
+        """
+        if isinstance(device_specifier, PrinterEmulator):
+            self.emulator = device_specifier
+        elif isinstance(device_specifier, str):
+            self.emulator = PrinterEmulator(**parse_identifier(device_specifier))
+        else:
+            raise NotImplementedError('Currently the printer can be specified either via an appropriate string or via a PrinterEmulator instance.')
+        self.read_timeout = 0.01
+        self.write_dev = self.emulator
+        self.read_dev  = self.emulator
+
+    def _write(self, data):
+        self.emulator.feed(data)
+
+    def _read(self, length=32):
+        data = self.emulator.read(length)
+        if not data:
+            self.emulator.wait(self.read_timeout)
+            data = self.emulator.read(length)
+        return data
+
+    def _read_blocking(self, length, timeout):
+        deadline = time.time() + timeout
+        while True:
+            data = self.emulator.read(length)
+            remaining = deadline - time.time()
+            if data or remaining <= 0:
+                return data
+            self.emulator.wait(remaining)
+
+    def _dispose(self):
+        pass
+
+def _serve(emulator, fd, recv, send):
+    """ Feeds the data received to the emulator and sends its responses until the peer disconnects """
+    while True:
+        due = emulator.next_response_time()
+        timeout = None if due is None else max(due - time.time(), 0)
+        readable, _, _ = select.select([fd], [], [], timeout)
+        if readable:
+            try:
+                data = recv(16*1024)
+            except (OSError, IOError):
+                data = b''
+            if not data:
+                return
+            emulator.feed(data)
+        response = emulator.read(32*1024)
+        if response:
+            try:
+                send(response)
+            except (OSError, IOError):
+                # the peer disconnected without waiting for the responses
+                return
+
+def serve_tcp(host='127.0.0.1', port=9100, **kwargs):
+    """
+    Emulates a network printer: accepts TCP connections and handles each
+    with a new :py:class:`PrinterEmulator` (created with the keyword arguments given).
+    Runs until interrupted.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(16)
+    logger.info('Emulating a %s on tcp://%s:%d', kwargs.get('model', 'QL-700'), host, server.getsockname()[1])
+    def handle(conn):
+        emulator = PrinterEmulator(**kwargs)
+        try:
+            _serve(emulator, conn, conn.recv, conn.sendall)
+        finally:
+            conn.close()
+            logger.info('Connection closed: %d bytes received, %d pages printed, %d errors.',
+                        emulator.bytes_received, emulator.pages_printed, emulator.errors)
+    try:
+        while True:
+            conn, _ = server.accept()
+            thread = threading.Thread(target=handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    finally:
+        server.close()
+
+def serve_pty(**kwargs):
+    """
+    Emulates a printer device file (like /dev/usb/lp0) with a pseudo terminal
+    and a :py:class:`PrinterEmulator` (created with the keyword arguments given).
+    The path of the device is logged. Runs until interrupted.
+    """
+    import pty, tty
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    logger.info('Emulating a %s on file://%s', kwargs.get('model', 'QL-700'), os.ttyname(slave))
+    emulator = PrinterEmulator(**kwargs)
+    try:
+        while True:
+            # the peer closing the device doesn't end the session: keep serving
+            _serve(emulator, master, lambda length: os.read(master, length), lambda data: os.write(master, data))
+    finally:
+        os.close(master)
+        os.close(slave)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""
+Load balancing of print jobs across a fleet of printers
+
+A :py:class:`PrinterFleet` knows the model and the loaded media of each of
+its printers. Every job is sent to the least loaded printer able to print
+it. If a printer reports an error, the job is sent to another one. Large
+batches are spread across all compatible printers.
+"""
+
+import logging, threading, time
+from collections import deque
+
+from brother_ql.backends.helpers import send, get_status, _BUFFER_TYPES
+from brother_ql.devicedependent import label_type_specs, DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL
+from brother_ql.exceptions import BrotherQLError
+
+logger = logging.getLogger(__name__)
+
+def media_of_label(label):
+    """
+    The media a printer needs to have loaded to print the given label.
+
+    :param str label: The label identifier, e.g. '62' or '29x90'.
+    :returns: A tuple (media_width, media_type, media_length) as reported by
+              :py:func:`brother_ql.reader.interpret_response`.
+    """
+    specs = label_type_specs[label]
+    width, length = specs['tape_size']
+    if specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
+        return width, 'Die-cut labels', length
+    return width, 'Continuous length tape', 0
+
+class FleetPrinter(object):
+    """ A printer of a :py:class:`PrinterFleet` and its state """
+
+    def __init__(self, identifier, model=None, backend_identifier=None, media_width=None, media_type=None, media_length=None):
+        self.identifier = identifier
+        self.model = model
+        self.backend_identifier = backend_identifier
+        #: The loaded media as reported by the printer (None if unknown)
+        self.media_width = media_width
+        self.media_type = media_type
+        self.media_length = media_length
+        #: The number of jobs currently sent to the printer
+        self.load = 0
+        self.jobs_done = 0
+        self.errors = 0
+        #: Time until which the printer is not used because of an error
+        self.failed_until = 0.
+
+    def is_compatible(self, model=None, label=None):
+        """ Whether the printer is of the given model and has the media needed for the label loaded (unknown media is assumed to fit) """
+        if model and self.model and model != self.model:
+            return False
+        if label and self.media_width is not None:
+            width, media_type, length = media_of_label(label)
+            if self.media_width != width or (self.media_type is not None and self.media_type != media_type):
+                return False
+            if media_type == 'Die-cut labels' and self.media_length and self.media_length != length:
+                return False
+        return True
+
+    def to_dict(self):
+        return {
+          'identifier': self.identifier,
+          'model': self.model,
+          'media_width': self.media_width,
+          'media_type': self.media_type,
+          'media_length': self.media_length,
+          'load': self.load,
+          'jobs_done': self.jobs_done,
+          'errors': self.errors,
+          'available': self.failed_until <= time.time(),
+        }
+
+class PrinterFleet(object):
+    """
+    Sends jobs to the least loaded compatible printer of a fleet.
+
+    :param printers: FleetPrinter instances or printer identifiers.
+    :param float timeout: The maximum time (in seconds) to wait for a printer to complete a job.
+    :param float retry_after: The time (in seconds) a printer is skipped after it failed.
+    """
+
+    def __init__(self, printers=(), timeout=10., retry_after=60.):
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.printers = []
+        self._lock = threading.Lock()
+        for printer in printers:
+            self.add_printer(printer)
+
+    def add_printer(self, printer, **kwargs):
+        """
+        Adds a printer to the fleet.
+
+        :param printer: A FleetPrinter instance or a printer identifier.
+                        In the latter case, the keyword arguments are those of :py:class:`FleetPrinter`.
+        """
+        if not isinstance(printer, FleetPrinter):
+            printer = FleetPrinter(printer, **kwargs)
+        with self._lock:
+            self.printers.append(printer)
+        return printer
+
+    def refresh_media(self, timeout=2.):
+        """ Queries the printers for the media they have loaded (in parallel) """
+        def refresh(printer):
+            try:
+                status = get_status(printer.identifier, printer.backend_identifier, timeout=timeout)
+            except Exception as e:
+                logger.warning('Could not query the status of %s: %s', printer.identifier, e)
+                return
+            if status is None:
+                logger.warning('No status received from %s.', printer.identifier)
+                return
+            printer.media_width = status['media_width']
+            printer.media_type = status['media_type']
+            printer.media_length = status['media_length']
+        threads = [threading.Thread(target=refresh, args=(printer,)) for printer in self.printers]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+    def _acquire(self, model, label, exclude):
+        """ Selects the least loaded compatible printer and increases its load """
+        now = time.time()
+        with self._lock:
+            candidates = [printer for printer in self.printers
+                          if printer not in exclude and printer.failed_until <= now
+                          and printer.is_compatible(model, label)]
+            if not candidates:
+                return None
+            printer = min(candidates, key=lambda printer: (printer.load, printer.jobs_done))
+            printer.load += 1
+            return printer
+
+    def _release(self, printer, failed):
+        with self._lock:
+            printer.load -= 1
+            if failed:
+                printer.errors += 1
+                printer.failed_until = time.time() + self.retry_after
+            else:
+                printer.jobs_done += 1
+
+    def send(self, instructions, model=None, label=None):
+        """
+        Sends a job to the least loaded printer of the given model with the media for the label loaded.
+        If the printer fails, the job is sent to the next one.
+
+        The whole job is sent to the next printer: labels of a multi-page job
+        printed by the failing printer before the error are printed again.
+
+        :param bytes instructions: The instructions to be sent (an iterable of chunks is
+                                   joined first, to be able to send it again).
+        :param str model: The model the instructions were created for.
+        :param str label: The label the instructions were created for.
+        :returns: The status dictionary of :py:func:`brother_ql.backends.helpers.send`
+                  with the additional key 'printer' (the identifier of the printer used).
+        :raises BrotherQLError: if no compatible printer could print the job.
+        """
+        if not isinstance(instructions, _BUFFER_TYPES):
+            instructions = b''.join(instructions)
+        tried = []
+        while True:
+            printer = self._acquire(model, label, tried)
+            if printer is None:
+                raise BrotherQLError('No compatible printer available (tried: {}).'.format(
+                                     ', '.join(printer.identifier for printer in tried) or 'none'))
+            tried.append(printer)
+            try:
+                status = send(instructions, printer.identifier, printer.backend_identifier, blocking=True, timeout=self.timeout)
+            except Exception as e:
+                logger.warning('Sending to %s failed: %s. Failing over.', printer.identifier, e)
+                self._release(printer, failed=True)
+                continue
+            failed = status['outcome'] == 'error'
+            self._release(printer, failed)
+            if failed:
+                logger.warning('%s reported errors: %s. Failing over.', printer.identifier,
+                               status['printer_state']['errors'] if status['printer_state'] else 'unknown')
+                continue
+            status['printer'] = printer.identifier
+            return status
+
+    def send_batch(self, jobs, model=None, label=None):
+        """
+        Prints many jobs, spread across all compatible printers (one worker thread per printer).
+
+        :param jobs: A sequence of instructions.
+        :returns: A list with the status dictionary (see :py:meth:`send`) or the
+                  exception raised for each job, in the order of the jobs.
+        """
+        queue = deque(enumerate(jobs))
+        results = [None] * len(queue)
+        workers = sum(1 for printer in self.printers if printer.is_compatible(model, label))
+        def work():
+            while True:
+                try:
+                    index, instructions = queue.popleft()
+                except IndexError:
+                    return
+                try:
+                    results[index] = self.send(instructions, model, label)
+                except BrotherQLError as e:
+                    results[index] = e
+        threads = [threading.Thread(target=work) for _ in range(max(workers, 1))]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        return results
@@ -1,10 +1,42 @@
 
 from builtins import bytes
 
-import logging
+import logging, time
+
+from attr import attrs, attrib, asdict
 
 logger = logging.getLogger(__name__)
 
+@attrs
+class WriteStats(object):
+    """
+    Counters of the data written to a printer (by a job).
+    """
+    #: The total number of bytes written
+    bytes_written = attrib(type=int, default=0)
+    #: The number of chunks written
+    chunks = attrib(type=int, default=0)
+    #: The number of writes taking only a part of the data offered
+    partial_writes = attrib(type=int, default=0)
+    #: The total time spent writing (in seconds)
+    duration = attrib(type=float, default=0.)
+    #: The time it took to write the first chunk (in seconds)
+    first_chunk_latency = attrib(type=float, default=None)
+    #: The longest time it took to write a chunk (in seconds)
+    max_chunk_latency = attrib(type=float, default=0.)
+
+    @property
+    def throughput(self):
+        """ The average throughput (in bytes per second), None if unknown """
+        if not self.duration:
+            return None
+        return self.bytes_written / self.duration
+
+    def to_dict(self):
+        result = asdict(self)
+        result['throughput'] = self.throughput
+        return result
+
 def list_available_devices():
     """ List all available devices for the respective backend """
     # returns a list of dictionaries with the keys 'identifier' and 'instance':
@@ -14,6 +46,15 @@ def list_available_devices():
 
 class BrotherQLBackendGeneric(object):
 
+    #: The size of the chunks the data is written in (in bytes)
+    chunk_size = 16*1024
+    #: The timeout for writing a chunk as long as the throughput is not known yet (in seconds)
+    initial_write_timeout = 10.
+    #: The minimum timeout for writing a chunk (in seconds)
+    min_write_timeout = 5.
+    #: The timeout for a chunk is this factor times the time expected from the measured throughput
+    write_timeout_factor = 4.
+
     def __init__(self, device_specifier):
         """
         device_specifier can be either a string or an instance
@@ -26,16 +67,116 @@ class BrotherQLBackendGeneric(object):
     def _write(self, data):
         self.write_dev.write(data)
 
+    def _write_chunk(self, chunk, timeout):
+        """
+        Writes a chunk completely within `timeout` seconds.
+        Backends override this method to handle partial writes and timeouts.
+
+        :returns: The number of partial writes needed.
+        """
+        self._write(chunk)
+        return 0
+
     def _read(self, length=32):
         return bytes(self.read_dev.read(length))
 
+    def _read_blocking(self, length, timeout):
+        """
+        Waits up to `timeout` seconds for data to arrive.
+        Backends able to wait for an event on their device override this
+        method; the fallback polls :py:meth:`_read` until the deadline.
+        """
+        deadline = time.time() + timeout
+        while True:
+            data = self._read(length)
+            if data or time.time() >= deadline:
+                return data
+            time.sleep(0.005)
+
+    @property
+    def write_stats(self):
+        """ The :py:class:`WriteStats` since the last call of :py:meth:`reset_write_stats` """
+        try:
+            return self._write_stats
+        except AttributeError:
+            self._write_stats = WriteStats()
+            return self._write_stats
+
+    def reset_write_stats(self):
+        """ Starts new counters (e.g. for a new job). The measured throughput is kept. """
+        self._write_stats = WriteStats()
+
+    def _chunk_timeout(self, length):
+        throughput = getattr(self, '_throughput', None)
+        if not throughput:
+            return self.initial_write_timeout
+        return max(self.min_write_timeout, self.write_timeout_factor * length / throughput)
+
+    def _record_chunk(self, length, latency, partial_writes=0):
+        """ Updates the write statistics and the measured throughput after writing a chunk """
+        stats = self.write_stats
+        stats.partial_writes += partial_writes
+        stats.bytes_written += length
+        stats.chunks += 1
+        stats.duration += latency
+        if stats.first_chunk_latency is None:
+            stats.first_chunk_latency = latency
+        stats.max_chunk_latency = max(stats.max_chunk_latency, latency)
+        if latency > 0:
+            # exponential moving average of the throughput
+            throughput = length / latency
+            previous = getattr(self, '_throughput', None)
+            self._throughput = throughput if previous is None else 0.7 * previous + 0.3 * throughput
+
     def write(self, data):
+        """
+        Writes data to the printer in chunks of :py:attr:`chunk_size` bytes.
+        The timeout for each chunk is derived from the throughput measured so far.
+
+        :param data: bytes or any other buffer (bytearray, memoryview, mmap). It is not copied.
+        """
         logger.debug('Writing %d bytes.', len(data))
-        self._write(data)
+        view = memoryview(data)
+        for offset in range(0, len(view), self.chunk_size):
+            chunk = view[offset:offset+self.chunk_size]
+            start = time.time()
+            partial_writes = self._write_chunk(chunk, self._chunk_timeout(len(chunk)))
+            self._record_chunk(len(chunk), time.time() - start, partial_writes)
 
-    def read(self, length=32):
+    def write_file(self, f, offset, count):
+        """
+        Writes `count` bytes of the file `f` starting at `offset` to the printer.
+        Backends override this method to let the kernel copy the data (sendfile).
+        The fallback reads the file in chunks into a reused buffer.
+
+        :param f: A file object opened in binary mode.
+        """
+        logger.debug('Writing %d bytes from a file.', count)
+        buf = bytearray(min(self.chunk_size, count))
+        view = memoryview(buf)
+        f.seek(offset)
+        while count > 0:
+            length = f.readinto(view[:min(len(buf), count)])
+            if not length:
+                raise EOFError('The file ended before all data was written.')
+            self.write(view[:length])
+            count -= length
+
+    def read(self, length=32, timeout=None):
+        """
+        Reads up to `length` bytes from the printer.
+
+        :param int length: The maximum number of bytes to read.
+        :param float timeout: If given, block for up to this many seconds
+                              until data arrives. Otherwise, the backend
+                              specific (short) read strategy is used.
+        :returns: The bytes read, empty if nothing was received.
+        """
         try:
-            ret_bytes = self._read(length)
+            if timeout is None:
+                ret_bytes = self._read(length)
+            else:
+                ret_bytes = self._read_blocking(length, max(timeout, 0))
             if ret_bytes: logger.debug('Read %d bytes.', len(ret_bytes))
             return ret_bytes
         except Exception as e:
@@ -7,13 +7,19 @@ Helpers for the subpackage brother_ql.backends
 * printing
 """
 
-import logging, time
+import functools, io, logging, mmap, time
 
 from brother_ql.backends import backend_factory, guess_backend
-from brother_ql.reader import interpret_response
+from brother_ql.backends.pool import default_pool
+from brother_ql.reader import interpret_response, page_boundaries, split_pages, PrinterStatus
 
 logger = logging.getLogger(__name__)
 
+#: The backends whose connections are kept open between calls of :py:func:`send` by default.
+#: USB printers are not pooled by default: a pooled pyusb connection keeps the interface claimed
+#: and the kernel driver detached, locking other processes out. Pass a pool explicitly to do so.
+pooled_backends = ('network',)
+
 def discover(backend_identifier='linux_kernel'):
 
     be = backend_factory(backend_identifier)
@@ -23,43 +29,254 @@ def discover(backend_identifier='linux_kernel'):
     available_devices = list_available_devices()
     return available_devices
 
-def send(instructions, printer_identifier=None, backend_identifier=None, blocking=True):
+def get_status(printer_identifier=None, backend_identifier=None, timeout=2., pool=True):
     """
-    Send instruction bytes to a printer.
+    Requests the status of a printer (including the media loaded).
 
-    :param bytes instructions: The instructions to be sent to the printer.
-    :param str printer_identifier: Identifier for the printer.
-    :param str backend_identifier: Can enforce the use of a specific backend.
-    :param bool blocking: Indicates whether the function call should block while waiting for the completion of the printing.
+    :param float timeout: The maximum time (in seconds) to wait for the answer.
+    :param pool: The connection pool to use, see :py:func:`send`.
+    :returns: The status as decoded by :py:func:`brother_ql.reader.interpret_response` or None if the printer didn't answer.
     """
+    selected_backend = select_backend(printer_identifier, backend_identifier)
+    if pool is True:
+        pool = default_pool if selected_backend in pooled_backends else None
+    if not pool:
+        printer = backend_factory(selected_backend)['backend_class'](printer_identifier)
+        try:
+            return _get_status(printer, timeout)
+        finally:
+            printer.dispose()
+    with pool.connection(selected_backend, printer_identifier) as printer:
+        return _get_status(printer, timeout)
+
+def _get_status(printer, timeout):
+    from brother_ql.raster import BrotherQLRaster
+    qlr = BrotherQLRaster()
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    qlr.add_status_information()
+
+    printer.write(qlr.data)
+    deadline = time.time() + timeout
+    data = b''
+    while True:
+        while len(data) < 32:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            data += printer.read(timeout=remaining)
+        response, data = data[:32], data[32:]
+        try:
+            result = interpret_response(response)
+        except (ValueError, NameError):
+            logger.error("Couln't understand response: %s", response)
+            return None
+        # a reused connection may still deliver status messages of the previous job
+        if result['status_type'] == 'Reply to status request':
+            return result
 
-    status = {
+def select_backend(printer_identifier=None, backend_identifier=None):
+    """ The backend to use: the stated one or the one guessed from the printer identifier """
+    if backend_identifier:
+        return backend_identifier
+    try:
+        return guess_backend(printer_identifier)
+    except:
+        logger.info("No backend stated. Selecting the default linux_kernel backend.")
+        return 'linux_kernel'
+
+def new_status():
+    """ The initial status dictionary of a sending operation as returned by :py:func:`send` """
+    return {
       'instructions_sent': True, # The instructions were sent to the printer.
       'outcome': 'unknown', # String description of the outcome of the sending operation like: 'unknown', 'sent', 'printed', 'error'
       'printer_state': None, # If the selected backend supports reading back the printer state, this key will contain it.
       'did_print': False, # If True, a print was produced. It defaults to False if the outcome is uncertain (due to a backend without read-back capability).
       'ready_for_next_job': False, # If True, the printer is ready to receive the next instructions. It defaults to False if the state is unknown.
+      'timings': { # Seconds since the start of the sending operation (None if the event did not happen):
+        'sent': None, # all instructions were written to the printer
+        'printing_completed': None, # the printer reported 'Printing completed'
+        'waiting_to_receive': None, # the printer reported 'Waiting to receive'
+      },
+      'write_stats': None, # The counters of the data written, see brother_ql.backends.generic.WriteStats.to_dict()
     }
-    selected_backend = None
-    if backend_identifier:
-        selected_backend = backend_identifier
+
+def update_status(status, response, elapsed):
+    """
+    Updates the status dictionary of a sending operation with a response of the printer.
+
+    :param dict status: The status dictionary, see :py:func:`new_status`.
+    :param bytes response: A status frame (32 bytes) received from the printer.
+    :param float elapsed: The seconds since the start of the sending operation.
+    :returns: True if no further responses need to be awaited.
+    """
+    try:
+        result = PrinterStatus.decode(response)
+    except ValueError:
+        logger.error("TIME %.3f - Couln't understand response: %s", elapsed, response)
+        return False
+    status['printer_state'] = result.to_dict()
+    logger.debug('TIME %.3f - result: %s', elapsed, result)
+    if result.errors:
+        logger.error('Errors occured: %s', list(result.errors))
+        status['outcome'] = 'error'
+        return True
+    if result.status_type == 'Printing completed':
+        status['did_print'] = True
+        status['outcome'] = 'printed'
+        status['timings']['printing_completed'] = elapsed
+    if result.status_type == 'Phase change' and result.phase_type == 'Waiting to receive':
+        status['ready_for_next_job'] = True
+        status['timings']['waiting_to_receive'] = elapsed
+    return status['did_print'] and status['ready_for_next_job']
+
+def log_outcome(status):
+    """ Logs the outcome of a (blocking) sending operation """
+    if not status['did_print']:
+        logger.warning("'printing completed' status not received.")
+    if not status['ready_for_next_job']:
+        logger.warning("'waiting to receive' status not received.")
+    if (not status['did_print']) or (not status['ready_for_next_job']):
+        logger.warning('Printing potentially not successful?')
+    if status['did_print'] and status['ready_for_next_job']:
+        logger.info("Printing was successful after %.3f s. Waiting for the next job.", status['timings']['waiting_to_receive'])
+
+def send(instructions, printer_identifier=None, backend_identifier=None, blocking=True, timeout=10., pool=True):
+    """
+    Send instruction bytes to a printer.
+
+    :param instructions: The instructions to be sent to the printer. Either bytes (or another buffer like
+                         a memoryview or mmap, sent page by page without copying) or an iterable
+                         of bytes chunks, as produced by :py:func:`brother_ql.conversion.convert_iter`.
+    :param str printer_identifier: Identifier for the printer.
+    :param str backend_identifier: Can enforce the use of a specific backend.
+    :param bool blocking: Indicates whether the function call should block while waiting for the completion of the printing.
+    :param float timeout: The maximum time (in seconds) to wait for the printer to report the completion of the printing.
+    :param pool: The :py:class:`brother_ql.backends.pool.ConnectionPool` to take the connection from.
+                 True (the default) selects the shared default pool for the backends in :py:data:`pooled_backends`,
+                 False (or None) opens a new connection for this call only.
+    """
+
+    selected_backend = select_backend(printer_identifier, backend_identifier)
+
+    if pool is True:
+        pool = default_pool if selected_backend in pooled_backends else None
+    if not pool:
+        be = backend_factory(selected_backend)
+        list_available_devices = be['list_available_devices']
+        BrotherQLBackend       = be['backend_class']
+
+        printer = BrotherQLBackend(printer_identifier)
+        return _send(printer, instructions, selected_backend, blocking, timeout)
+
+    with pool.connection(selected_backend, printer_identifier) as printer:
+        return _send(printer, instructions, selected_backend, blocking, timeout, reconnect=printer.reconnect)
+
+#: Instructions of these types are split into pages and written without copying them
+_BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+class _FileInstructions(object):
+    """ Instructions in a (memory mapped) file, written page by page with the backend's write_file() """
+
+    def __init__(self, f, mm):
+        self.file = f
+        self.mmap = mm
+
+    def __len__(self):
+        return len(self.mmap)
+
+    def parts(self):
+        start = 0
+        for end in page_boundaries(self.mmap):
+            yield end - start, functools.partial(self._write, offset=start, count=end - start)
+            start = end
+        if start < len(self.mmap):
+            yield len(self.mmap) - start, functools.partial(self._write, offset=start, count=len(self.mmap) - start)
+
+    def _write(self, printer, offset, count):
+        printer.write_file(self.file, offset, count)
+
+def _parts(instructions, split=False):
+    """
+    The parts of the instructions as tuples of their length and a function writing them to a printer
+
+    Buffers are split into pages only if `split` is True (parsing them costs time).
+    """
+    if isinstance(instructions, _FileInstructions):
+        return instructions.parts()
+    if isinstance(instructions, _BUFFER_TYPES):
+        chunks = split_pages(instructions) if split else (instructions,)
     else:
+        chunks = instructions
+    return ((len(chunk), functools.partial(_write_chunk, chunk=chunk)) for chunk in chunks)
+
+def _write_chunk(printer, chunk):
+    printer.write(chunk)
+
+def _write_instructions(printer, instructions, reconnect=None):
+    """
+    Writes the instructions to the printer: bytes or another buffer (like a
+    memoryview or mmap, written without copying) or an iterable of chunks.
+    If writing the first part fails and `reconnect` is given, it is called to
+    obtain a new connection to retry once. Buffers are written page by page
+    then, so that no page is sent twice.
+
+    :returns: The printer (backend instance) finally written to.
+    """
+    sized = isinstance(instructions, _BUFFER_TYPES + (_FileInstructions,))
+    if sized:
+        logger.info('Sending instructions to the printer. Total: %d bytes.', len(instructions))
+    total = 0
+    for length, write in _parts(instructions, split=reconnect is not None):
         try:
-            selected_backend = guess_backend(printer_identifier)
-        except:
-            logger.info("No backend stated. Selecting the default linux_kernel backend.")
-            selected_backend = 'linux_kernel'
+            write(printer)
+        except (OSError, IOError) as e:
+            if total or reconnect is None:
+                raise
+            # nothing went through yet: the connection was probably stale
+            logger.warning('Writing to the printer failed (%s). Reconnecting.', e)
+            printer = reconnect()
+            printer.reset_write_stats()
+            write(printer)
+        total += length
+    if not sized:
+        logger.info('Sent instructions to the printer. Total: %d bytes.', total)
+    return printer
 
-    be = backend_factory(selected_backend)
-    list_available_devices = be['list_available_devices']
-    BrotherQLBackend       = be['backend_class']
+def send_file(instruction_file, printer_identifier=None, backend_identifier=None, blocking=True, timeout=10., pool=True):
+    """
+    Send an instruction file to a printer.
+
+    The file is memory mapped and sent page by page without reading it
+    into memory, using sendfile() where the backend supports it.
+    Files which cannot be memory mapped (like pipes) are read completely.
+
+    :param instruction_file: The path of the file or a file object opened in binary mode.
+    :returns: The status dictionary, see :py:func:`send`.
+    """
+    if isinstance(instruction_file, str):
+        with io.open(instruction_file, 'rb') as f:
+            return send_file(f, printer_identifier, backend_identifier, blocking, timeout, pool)
+    f = instruction_file
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError, io.UnsupportedOperation):
+        # not a regular file or an empty one
+        return send(f.read(), printer_identifier, backend_identifier, blocking, timeout, pool)
+    try:
+        return send(_FileInstructions(f, mm), printer_identifier, backend_identifier, blocking, timeout, pool)
+    finally:
+        mm.close()
 
-    printer = BrotherQLBackend(printer_identifier)
+def _send(printer, instructions, selected_backend, blocking, timeout, reconnect=None):
+    status = new_status()
 
     start = time.time()
-    logger.info('Sending instructions to the printer. Total: %d bytes.', len(instructions))
-    printer.write(instructions)
+    printer.reset_write_stats()
+    printer = _write_instructions(printer, instructions, reconnect)
+    status['write_stats'] = printer.write_stats.to_dict()
     status['outcome'] = 'sent'
+    status['timings']['sent'] = time.time() - start
 
     if not blocking:
         return status
@@ -67,37 +284,19 @@ def send(instructions, printer_identifier=None, backend_identifier=None, blockin
         """ No need to wait for completion. The network backend doesn't support readback. """
         return status
 
-    while time.time() - start < 10:
-        data = printer.read()
-        if not data:
-            time.sleep(0.005)
-            continue
-        try:
-            result = interpret_response(data)
-        except ValueError:
-            logger.error("TIME %.3f - Couln't understand response: %s", time.time()-start, data)
-            continue
-        status['printer_state'] = result
-        logger.debug('TIME %.3f - result: %s', time.time()-start, result)
-        if result['errors']:
-            logger.error('Errors occured: %s', result['errors'])
-            status['outcome'] = 'error'
+    deadline = start + timeout
+    data = b''
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
             break
-        if result['status_type'] == 'Printing completed':
-            status['did_print'] = True
-            status['outcome'] = 'printed'
-        if result['status_type'] == 'Phase change' and result['phase_type'] == 'Waiting to receive':
-            status['ready_for_next_job'] = True
-        if status['did_print'] and status['ready_for_next_job']:
+        # blocks until the printer answers or the deadline is reached
+        data += printer.read(timeout=remaining)
+        if len(data) < 32:
+            continue
+        response, data = data[:32], data[32:]
+        if update_status(status, response, time.time() - start):
             break
 
-    if not status['did_print']:
-        logger.warning("'printing completed' status not received.")
-    if not status['ready_for_next_job']:
-        logger.warning("'waiting to receive' status not received.")
-    if (not status['did_print']) or (not status['ready_for_next_job']):
-        logger.warning('Printing potentially not successful?')
-    if status['did_print'] and status['ready_for_next_job']:
-        logger.info("Printing was successful. Waiting for the next job.")
-
+    log_outcome(status)
     return status
@@ -8,7 +8,7 @@ Works on Linux.
 from __future__ import unicode_literals
 from builtins import str
 
-import glob, os, time, select
+import glob, os, time, select, errno
 
 from .generic import BrotherQLBackendGeneric
 
@@ -42,8 +42,10 @@ class BrotherQLBackendLinuxKernel(BrotherQLBackendGeneric):
         if isinstance(device_specifier, str):
             if device_specifier.startswith('file://'):
                 device_specifier = device_specifier[7:]
-            self.dev = os.open(device_specifier, os.O_RDWR)
+            # non-blocking, so that the write timeouts apply to a stalled printer as well
+            self.dev = os.open(device_specifier, os.O_RDWR | os.O_NONBLOCK)
         elif isinstance(device_specifier, int):
+            # the timeouts only apply if the handle was opened with O_NONBLOCK
             self.dev = device_specifier
         else:
             raise NotImplementedError('Currently the printer can be specified either via an appropriate string or via an os.open() handle.')
@@ -52,32 +54,83 @@ class BrotherQLBackendLinuxKernel(BrotherQLBackendGeneric):
         self.read_dev  = self.dev
 
     def _write(self, data):
-        os.write(self.write_dev, data)
+        self._write_chunk(data, None)
+
+    def _write_chunk(self, chunk, timeout):
+        # os.write() may take only a part of the data
+        view = memoryview(chunk)
+        deadline = None if timeout is None else time.time() + timeout
+        partial_writes = 0
+        while True:
+            try:
+                written = os.write(self.write_dev, view)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                written = 0
+            view = view[written:]
+            if not view:
+                return partial_writes
+            partial_writes += 1
+            self._wait_writable(None if deadline is None else max(deadline - time.time(), 0))
+
+    def _wait_writable(self, timeout):
+        _, result, _ = select.select([], [self.write_dev], [], timeout)
+        if self.write_dev not in result:
+            raise IOError(errno.ETIMEDOUT, 'Timeout writing to the printer')
+
+    def write_file(self, f, offset, count):
+        """
+        Writes part of a file using os.sendfile() (zero-copy). Falls back to
+        the generic implementation if the device doesn't support it.
+        """
+        if not hasattr(os, 'sendfile'):
+            return super(BrotherQLBackendLinuxKernel, self).write_file(f, offset, count)
+        end = offset + count
+        while offset < end:
+            length = min(self.chunk_size, end - offset)
+            start = time.time()
+            try:
+                written = os.sendfile(self.write_dev, f.fileno(), offset, length)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self._wait_writable(self._chunk_timeout(length))
+                    continue
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                return super(BrotherQLBackendLinuxKernel, self).write_file(f, offset, end - offset)
+            if not written:
+                raise EOFError('The file ended before all data was written.')
+            self._record_chunk(written, time.time() - start, int(written < length))
+            offset += written
+
+    def _os_read(self, length):
+        try:
+            return os.read(self.read_dev, length)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return b''
 
     def _read(self, length=32):
         if self.strategy == 'try_twice':
-            data = os.read(self.read_dev, length)
+            data = self._os_read(length)
             if data:
                 return data
             else:
                 time.sleep(self.read_timeout)
-                return os.read(self.read_dev, length)
+                return self._os_read(length)
         elif self.strategy == 'select':
-            data = b''
-            start = time.time()
-            while (not data) and (time.time() - start < self.read_timeout):
-                result, _, _ = select.select([self.read_dev], [], [], 0)
-                if self.read_dev in result:
-                    data += os.read(self.read_dev, length)
-                if data: break
-                time.sleep(0.001)
-            if not data:
-                # one last try if still no data:
-                return os.read(self.read_dev, length)
-            else:
-                return data
+            return self._read_blocking(length, self.read_timeout)
         else:
             raise NotImplementedError('Unknown strategy')
 
+    def _read_blocking(self, length, timeout):
+        # a single wait for the device to become readable, no polling
+        result, _, _ = select.select([self.read_dev], [], [], timeout)
+        if self.read_dev in result:
+            return self._os_read(length)
+        return b''
+
     def _dispose(self):
         os.close(self.dev)
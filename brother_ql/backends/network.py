@@ -8,10 +8,12 @@ Works cross-platform.
 from __future__ import unicode_literals
 from builtins import str
 
-import socket, os, time, select
+import socket, os, time, select, errno, logging
 
 from .generic import BrotherQLBackendGeneric
 
+logger = logging.getLogger(__name__)
+
 def list_available_devices():
     """
     List all available devices for the network backend
@@ -66,9 +68,16 @@ class BrotherQLBackendNetwork(BrotherQLBackendGeneric):
             raise NotImplementedError('Currently the printer can be specified either via an appropriate string or via an os.open() handle.')
 
     def _write(self, data):
-        self.s.settimeout(10)
-        self.s.sendall(data)
-        self.s.settimeout(self.read_timeout)
+        self._write_chunk(data, 10)
+
+    def _write_chunk(self, chunk, timeout):
+        # sendall() takes care of partial sends
+        self.s.settimeout(timeout)
+        try:
+            self.s.sendall(chunk)
+        finally:
+            self.s.settimeout(self.read_timeout)
+        return 0
 
     def _read(self, length=32):
         if self.strategy in ('socket_timeout', 'try_twice'):
@@ -96,6 +105,49 @@ class BrotherQLBackendNetwork(BrotherQLBackendGeneric):
         else:
             raise NotImplementedError('Unknown strategy')
 
+    def _read_blocking(self, length, timeout):
+        self.s.settimeout(timeout)
+        try:
+            return self.s.recv(length)
+        except socket.timeout:
+            return b''
+        finally:
+            self.s.settimeout(self.read_timeout)
+
+    def write_file(self, f, offset, count):
+        """ Writes part of a file using sendfile() (zero-copy) """
+        if not hasattr(self.s, 'sendfile'): # Py2
+            return super(BrotherQLBackendNetwork, self).write_file(f, offset, count)
+        logger.debug('Sending %d bytes from a file.', count)
+        end = offset + count
+        try:
+            while offset < end:
+                length = min(self.chunk_size, end - offset)
+                self.s.settimeout(self._chunk_timeout(length))
+                start = time.time()
+                self.s.sendfile(f, offset, length)
+                self._record_chunk(length, time.time() - start)
+                offset += length
+        finally:
+            self.s.settimeout(self.read_timeout)
+
+    def is_alive(self):
+        """
+        Checks without blocking whether the connection is still open (not closed by the printer).
+
+        Data left unread from the previous job (e.g. the reply to a status request)
+        is drained: peeking at it would hide that the printer closed the connection.
+        """
+        self.s.settimeout(0)
+        try:
+            while True:
+                if not self.s.recv(4096):
+                    return False
+        except socket.error as e:
+            return e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)
+        finally:
+            self.s.settimeout(self.read_timeout)
+
     def _dispose(self):
         self.s.shutdown(socket.SHUT_RDWR)
         self.s.close()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+A pool of persistent printer connections
+
+Connecting to a network printer (and shutting the connection down again)
+for every single job is a considerable share of the time needed to print
+a small label. The :py:class:`ConnectionPool` keeps the connections open
+between jobs, keyed by the backend and the printer identifier.
+"""
+
+import atexit, logging, threading, time
+from contextlib import contextmanager
+
+from brother_ql.backends import backend_factory
+from brother_ql.exceptions import BrotherQLError
+
+logger = logging.getLogger(__name__)
+
+class _PoolEntry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        #: The thread holding the lock
+        self.owner = None
+        self.printer = None
+        self.last_used = 0.
+
+class ConnectionPool(object):
+    """
+    Keeps backend instances (connections) open for reuse.
+
+    A connection is used by a single job at a time: jobs for the same printer
+    are serialized by a per-printer lock, jobs for different printers proceed
+    in parallel. The lock is not reentrant: requesting a connection to a printer
+    while the same thread holds one already (e.g. sending a job while a
+    :py:class:`brother_ql.backends.session.PrintSession` to the printer is open)
+    raises a :py:class:`brother_ql.exceptions.BrotherQLError`. Before reuse, a connection is checked with the backend's
+    ``is_alive()`` method and replaced if it was closed by the printer.
+
+    While connections are open, a background thread closes the ones idle
+    for too long, so that the printers are not blocked for other hosts
+    and processes after the last job.
+
+    :param float max_idle_time: Connections unused for longer than this (in seconds) are closed.
+    """
+
+    def __init__(self, max_idle_time=60.):
+        self.max_idle_time = max_idle_time
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _PoolEntry()
+            return entry
+
+    def _open(self, key):
+        backend_identifier, printer_identifier = key
+        BrotherQLBackend = backend_factory(backend_identifier)['backend_class']
+        logger.debug('Opening a new connection to %s.', printer_identifier)
+        return BrotherQLBackend(printer_identifier)
+
+    @staticmethod
+    def _close(entry):
+        if entry.printer is not None:
+            entry.printer.dispose()
+            entry.printer = None
+
+    def _healthy(self, entry):
+        if entry.printer is None:
+            return False
+        if time.time() - entry.last_used > self.max_idle_time:
+            logger.debug('Closing a connection idle for too long.')
+            return False
+        is_alive = getattr(entry.printer, 'is_alive', None)
+        if is_alive is not None and not is_alive():
+            logger.debug('Closing a connection lost in the meantime.')
+            return False
+        return True
+
+    @contextmanager
+    def connection(self, backend_identifier, printer_identifier):
+        """
+        Context manager providing a connected backend instance for the printer,
+        locked for the exclusive use by the caller.
+
+        If an exception is raised within the context, the connection is
+        closed instead of returned to the pool.
+        The object provided has an additional ``reconnect()`` method which
+        replaces the connection by a fresh one and returns it.
+        """
+        key = (backend_identifier, printer_identifier)
+        entry = self._entry(key)
+        if entry.owner is threading.current_thread():
+            raise BrotherQLError('The connection to %s is in use by this thread already '
+                                 '(e.g. by an open print session).' % printer_identifier)
+        with entry.lock:
+            entry.owner = threading.current_thread()
+            try:
+                self.evict_idle()
+                if not self._healthy(entry):
+                    self._close(entry)
+                    entry.printer = self._open(key)
+                connection = _Connection(self, entry, key)
+                try:
+                    yield connection
+                except:
+                    self._close(entry)
+                    raise
+                entry.last_used = time.time()
+            finally:
+                entry.owner = None
+        self._start_reaper()
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, name='connection pool reaper')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap(self):
+        # runs as long as there are open connections
+        while True:
+            time.sleep(max(self.max_idle_time / 2., 0.01))
+            self.evict_idle()
+            with self._lock:
+                if all(entry.printer is None for entry in self._entries.values()):
+                    self._reaper = None
+                    return
+
+    def evict_idle(self):
+        """ Closes all connections currently not in use and idle for longer than `max_idle_time` """
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            if entry.printer is None or now - entry.last_used <= self.max_idle_time:
+                continue
+            if entry.lock.acquire(False):
+                try:
+                    self._close(entry)
+                finally:
+                    entry.lock.release()
+
+    def close(self, wait=True):
+        """ Closes all connections, waiting for the ones in use (or skipping them if `wait` is False) """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if not entry.lock.acquire(wait):
+                continue
+            try:
+                self._close(entry)
+            finally:
+                entry.lock.release()
+
+class _Connection(object):
+    """ The backend instance of a pool entry, forwarding to it and allowing to reconnect """
+
+    def __init__(self, pool, entry, key):
+        self._pool = pool
+        self._entry = entry
+        self._key = key
+
+    def __getattr__(self, name):
+        return getattr(self._entry.printer, name)
+
+    def reconnect(self):
+        self._pool._close(self._entry)
+        self._entry.printer = self._pool._open(self._key)
+        return self
+
+#: The pool used by :py:func:`brother_ql.backends.helpers.send` by default
+default_pool = ConnectionPool()
+
+# release the printers when the interpreter exits, not only after max_idle_time
+atexit.register(default_pool.close, wait=False)
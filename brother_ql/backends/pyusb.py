@@ -11,13 +11,22 @@ Install via `pip install pyusb`
 from __future__ import unicode_literals
 from builtins import str, bytes
 
-import time
+import errno, threading, time
 
 import usb.core
 import usb.util
 
 from .generic import BrotherQLBackendGeneric
 
+LIBUSB_ERROR_TIMEOUT = -7
+
+#: The time (in seconds) the result of the device discovery is reused for
+#: resolving printer identifiers, see :py:func:`cached_available_devices`.
+discovery_cache_ttl = 30.
+
+_discovery_cache = {'devices': None, 'time': 0.}
+_discovery_lock = threading.Lock()
+
 def list_available_devices():
     """
     List all available devices for the respective backend
@@ -54,6 +63,59 @@ def list_available_devices():
 
     return [{'identifier': identifier(printer), 'instance': printer} for printer in printers]
 
+def cached_available_devices():
+    """
+    Like :py:func:`list_available_devices`, but reusing the result for
+    :py:data:`discovery_cache_ttl` seconds. Walking all USB devices and
+    fetching their serial numbers is slow on hosts with many devices.
+    The device instances returned must not be used for communication,
+    they are shared by all callers. See :py:func:`_open_device`.
+    """
+    with _discovery_lock:
+        if _discovery_cache['devices'] is None or time.time() - _discovery_cache['time'] > discovery_cache_ttl:
+            devices = list_available_devices()
+            for result in devices:
+                # fetching the serial number opened the device
+                usb.util.dispose_resources(result['instance'])
+            _discovery_cache['devices'] = devices
+            _discovery_cache['time'] = time.time()
+        return _discovery_cache['devices']
+
+def invalidate_device_cache():
+    """ Forces the next lookup of a printer to discover the devices again (e.g. after replugging) """
+    with _discovery_lock:
+        _discovery_cache['devices'] = None
+
+def _parse_identifier(identifier):
+    """ Splits an identifier like usb://0x04f9:0x2015/C5Z315686 into (vendor, product, serial) """
+    if identifier.startswith('usb://'):
+        identifier = identifier[6:]
+    vendor_product, sep, serial = identifier.partition('/')
+    if not sep:
+        # the format used by list_available_devices()
+        vendor_product, _, serial = identifier.partition('_')
+    vendor, _, product = vendor_product.partition(':')
+    return int(vendor, 16), int(product, 16), serial
+
+def _find_device(device_specifier, devices):
+    vendor, product, serial = _parse_identifier(device_specifier)
+    for result in devices:
+        candidate = _parse_identifier(result['identifier'])
+        if candidate[:2] == (vendor, product) and (not serial or candidate[2] == serial):
+            return result['instance']
+    return None
+
+def _open_device(device_specifier):
+    """
+    Finds the printer in the cached discovery result and returns a device
+    instance of its own for the caller (a shared instance would be released
+    by the disposal of any other backend instance), None if not found.
+    """
+    cached = _find_device(device_specifier, cached_available_devices())
+    if cached is None:
+        return None
+    return usb.core.find(idVendor=cached.idVendor, idProduct=cached.idProduct, bus=cached.bus, address=cached.address)
+
 class BrotherQLBackendPyUSB(BrotherQLBackendGeneric):
     """
     BrotherQL backend using PyUSB
@@ -71,25 +133,21 @@ class BrotherQLBackendPyUSB(BrotherQLBackendGeneric):
         # strategy : try_twice or select
         self.strategy = 'try_twice'
         if isinstance(device_specifier, str):
-            if device_specifier.startswith('usb://'):
-                device_specifier = device_specifier[6:]
-            vendor_product, _, serial = device_specifier.partition('/')
-            vendor, _, product = vendor_product.partition(':')
-            vendor, product = int(vendor, 16), int(product, 16)
-            for result in list_available_devices():
-                printer = result['instance']
-                if printer.idVendor == vendor and printer.idProduct == product or (serial and printer.iSerialNumber == serial):
-                    self.dev = printer
-                    break
+            self.dev = _open_device(device_specifier)
+            if self.dev is None:
+                # the cached discovery result may be stale (e.g. the printer was replugged)
+                invalidate_device_cache()
+                self.dev = _open_device(device_specifier)
             if self.dev is None:
                 raise ValueError('Device not found')
+            self._setup()
         elif isinstance(device_specifier, usb.core.Device):
             self.dev = device_specifier
+            self._setup()
         else:
             raise NotImplementedError('Currently the printer can be specified either via an appropriate string or via a usb.core.Device instance.')
 
-        # Now we are sure to have self.dev around, start using it:
-
+    def _setup(self):
         try:
             assert self.dev.is_kernel_driver_active(0)
             self.dev.detach_kernel_driver(0)
@@ -97,13 +155,19 @@ class BrotherQLBackendPyUSB(BrotherQLBackendGeneric):
         except (NotImplementedError, AssertionError):
             self.was_kernel_driver_active = False
 
-        # set the active configuration. With no arguments, the first configuration will be the active one
-        self.dev.set_configuration()
-
-        cfg = self.dev.get_active_configuration()
+        try:
+            # the device may be configured already (and in use by another instance)
+            cfg = self.dev.get_active_configuration()
+        except usb.core.USBError:
+            # set the active configuration. With no arguments, the first configuration will be the active one
+            self.dev.set_configuration()
+            cfg = self.dev.get_active_configuration()
         intf = usb.util.find_descriptor(cfg, bInterfaceClass=7)
         assert intf is not None
 
+        # keep the interface claimed for the lifetime of the backend instance
+        usb.util.claim_interface(self.dev, intf)
+
         ep_match_in  = lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_IN
         ep_match_out = lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_OUT
 
@@ -145,8 +209,32 @@ class BrotherQLBackendPyUSB(BrotherQLBackendGeneric):
         else:
             raise NotImplementedError('Unknown strategy')
 
+    def _read_blocking(self, length, timeout):
+        # libusb waits for the transfer itself (the timeout is given in ms)
+        try:
+            return bytes(self.read_dev.read(length, max(int(timeout*1000), 1)))
+        except usb.core.USBError as e:
+            if getattr(e, 'errno', None) == errno.ETIMEDOUT or getattr(e, 'backend_error_code', None) == LIBUSB_ERROR_TIMEOUT:
+                return b''
+            raise
+
     def _write(self, data):
-        self.write_dev.write(data, int(self.write_timeout))
+        self._write_chunk(data, self.write_timeout/1000.)
+
+    def _write_chunk(self, chunk, timeout):
+        # the endpoint may accept only a part of the data
+        view = memoryview(chunk)
+        deadline = time.time() + timeout
+        partial_writes = 0
+        while True:
+            remaining = max(int((deadline - time.time())*1000), 1)
+            written = self.write_dev.write(view, remaining)
+            view = view[written:]
+            if not view:
+                return partial_writes
+            if time.time() >= deadline:
+                raise IOError(errno.ETIMEDOUT, 'Timeout writing to the printer')
+            partial_writes += 1
 
     def _dispose(self):
         usb.util.dispose_resources(self.dev)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""
+Pipelined printing of many jobs over a single backend connection
+
+:py:func:`brother_ql.backends.helpers.send` waits for a job to be printed
+completely before the next one can be sent. A :py:class:`PrintSession`
+keeps the backend open and transfers the next job while the printer is
+still printing the previous one. The status messages of the printer gate
+the transfer so that it never gets more than one job ahead of the
+printing.
+"""
+
+import logging, sys, time
+from collections import deque
+
+from brother_ql.backends import backend_factory
+from brother_ql.backends.helpers import select_backend, new_status, pooled_backends, _write_instructions, \
+                                       _BUFFER_TYPES, _FileInstructions
+from brother_ql.backends.pool import default_pool
+from brother_ql.exceptions import BrotherQLError
+from brother_ql.reader import PrinterStatus, page_boundaries, parse_instructions, _PRINT_OPCODES
+
+logger = logging.getLogger(__name__)
+
+def _counting_pages(chunks, pages):
+    """ Passes the chunks of instructions on, counting their print commands in pages[0] """
+    rest = bytearray()
+    for chunk in chunks:
+        rest += chunk
+        end = 0
+        for opcode, offset, length in parse_instructions(rest, partial=True):
+            end = offset + length
+            if opcode in _PRINT_OPCODES:
+                pages[0] += 1
+        del rest[:end]
+        yield chunk
+
+class PrintSession(object):
+    """
+    Sends jobs to a printer over a single backend connection.
+
+    A job is transferred once the printer started printing the last page
+    of the previous job (phase 'Printing state') and fewer than
+    `max_in_flight` jobs are not printed completely yet. The status messages
+    are per page: a job is printed once all of its pages are. Backends without status readback
+    (network) send the jobs without gating.
+
+    Usage::
+
+        with PrintSession('usb://0x04f9:0x209b') as session:
+            for instructions in jobs:
+                session.submit(instructions)
+        print(session.labels_per_minute)
+
+    :param str printer_identifier: Identifier for the printer.
+    :param str backend_identifier: Can enforce the use of a specific backend.
+    :param int max_in_flight: The maximum number of jobs sent but not printed yet.
+    :param float timeout: The maximum time (in seconds) to wait for a status message of the printer.
+    :param pool: The connection pool to take the connection from (for the lifetime of the session),
+                 see :py:func:`brother_ql.backends.helpers.send`. While the session is open, sending
+                 to the same printer through the pool from the same thread raises a
+                 :py:class:`brother_ql.exceptions.BrotherQLError` instead of blocking forever.
+    """
+
+    def __init__(self, printer_identifier=None, backend_identifier=None, max_in_flight=2, timeout=10., pool=True):
+        self.selected_backend = select_backend(printer_identifier, backend_identifier)
+        if pool is True:
+            pool = default_pool if self.selected_backend in pooled_backends else None
+        if pool:
+            self._connection = pool.connection(self.selected_backend, printer_identifier)
+            self.printer = self._connection.__enter__()
+        else:
+            self._connection = None
+            BrotherQLBackend = backend_factory(self.selected_backend)['backend_class']
+            self.printer = BrotherQLBackend(printer_identifier)
+        #: The network backend doesn't support readback.
+        self.readback = self.selected_backend != 'network'
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        #: The status dictionaries of all jobs submitted (see :py:func:`brother_ql.backends.helpers.new_status`)
+        self.jobs = []
+        self._in_flight = deque()
+        self._receiving = None
+        self._starts = {}
+        #: For every job in flight: [pages, pages started, pages completed]
+        self._pages = {}
+        self._data = b''
+        self._first_sent = None
+        self._last_completed = None
+        self._labels_printed = 0
+        self._error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(wait=exc_type is None, exc_info=(exc_type, exc, tb))
+
+    @property
+    def labels_printed(self):
+        """ The number of pages printed """
+        return self._labels_printed
+
+    @property
+    def labels_per_minute(self):
+        """ The rate of printing from the start of the first transfer to the last completion, None if unknown """
+        if self._first_sent is None or self._last_completed is None or self._last_completed <= self._first_sent:
+            return None
+        return self.labels_printed * 60. / (self._last_completed - self._first_sent)
+
+    def submit(self, instructions):
+        """
+        Sends a job as soon as the printer is ready for it.
+
+        :param instructions: The instructions of the job (bytes or an iterable of chunks).
+        :returns: The status dictionary of the job, updated as the printer reports progress.
+        """
+        self._wait(lambda: self._receiving is None and len(self._in_flight) < self.max_in_flight)
+        status = new_status()
+        status['timings']['printing_started'] = None
+        start = time.time()
+        if self._first_sent is None:
+            self._first_sent = start
+        self.printer.reset_write_stats()
+        if isinstance(instructions, _BUFFER_TYPES):
+            pages = [sum(1 for _ in page_boundaries(instructions))]
+        elif isinstance(instructions, _FileInstructions):
+            pages = [sum(1 for _ in page_boundaries(instructions.mmap))]
+        else:
+            pages = [0]
+            instructions = _counting_pages(instructions, pages)
+        _write_instructions(self.printer, instructions)
+        status['write_stats'] = self.printer.write_stats.to_dict()
+        status['outcome'] = 'sent'
+        status['timings']['sent'] = time.time() - start
+        self.jobs.append(status)
+        self._starts[id(status)] = start
+        if self.readback and pages[0]:
+            self._in_flight.append(status)
+            self._pages[id(status)] = [pages[0], 0, 0]
+            self._receiving = status
+        return status
+
+    def wait(self):
+        """ Waits for all jobs sent to be printed """
+        self._wait(lambda: not self._in_flight)
+
+    def close(self, wait=True, exc_info=None):
+        """
+        Closes the connection (or returns it to the pool), waiting for the jobs to be printed first if `wait` is True
+
+        :param tuple exc_info: The exception (as returned by ``sys.exc_info()``) which interrupted
+                               the session. A pooled connection is closed instead of returned then.
+        """
+        exc_info = exc_info or (None, None, None)
+        try:
+            if wait:
+                self.wait()
+        except BaseException:
+            exc_info = sys.exc_info()
+            raise
+        finally:
+            if self._connection is None:
+                self.printer.dispose()
+            else:
+                # a connection left in an unknown state is closed instead of returned to the pool
+                self._connection.__exit__(*exc_info)
+            if self.jobs:
+                logger.info('Session: %d of %d labels printed (%s labels/minute).', self.labels_printed,
+                            len(self.jobs), '%.1f' % self.labels_per_minute if self.labels_per_minute else 'unknown')
+
+    def _wait(self, condition):
+        if self._error:
+            raise BrotherQLError(self._error)
+        if not self.readback:
+            return
+        deadline = time.time() + self.timeout
+        while not condition():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise BrotherQLError('Timeout waiting for the printer.')
+            self._data += self.printer.read(timeout=remaining)
+            while len(self._data) >= 32:
+                response, self._data = self._data[:32], self._data[32:]
+                self._process(response)
+                # any status message means the printer is still alive
+                deadline = time.time() + self.timeout
+            if self._error:
+                raise BrotherQLError(self._error)
+
+    def _elapsed(self, status):
+        return time.time() - self._starts[id(status)]
+
+    def _process(self, response):
+        try:
+            result = PrinterStatus.decode(response)
+        except ValueError:
+            logger.error("Couln't understand response: %s", response)
+            return
+        logger.debug('result: %s', result)
+        oldest = self._in_flight[0] if self._in_flight else None
+        if oldest is not None:
+            oldest['printer_state'] = result.to_dict()
+        if result.errors:
+            logger.error('Errors occured: %s', list(result.errors))
+            for status in self._in_flight:
+                status['outcome'] = 'error'
+            self._in_flight.clear()
+            self._pages.clear()
+            self._receiving = None
+            self._error = 'The printer reported errors: {}'.format(', '.join(result.errors))
+            return
+        if result.status_type == 'Phase change' and result.phase_type == 'Printing state':
+            # the printer started to print the next page of the oldest job not printing all of its pages yet
+            for status in self._in_flight:
+                pages = self._pages[id(status)]
+                if pages[1] < pages[0]:
+                    if pages[1] == 0:
+                        status['timings']['printing_started'] = self._elapsed(status)
+                    pages[1] += 1
+                    if pages[1] == pages[0] and status is self._receiving:
+                        self._receiving = None
+                    break
+        elif result.status_type == 'Printing completed' and oldest is not None:
+            pages = self._pages[id(oldest)]
+            pages[2] += 1
+            self._labels_printed += 1
+            self._last_completed = time.time()
+            if pages[2] < pages[0]:
+                return
+            self._in_flight.popleft()
+            del self._pages[id(oldest)]
+            if oldest is self._receiving:
+                self._receiving = None
+            oldest['did_print'] = True
+            oldest['outcome'] = 'printed'
+            oldest['timings']['printing_completed'] = self._elapsed(oldest)
+        elif result.status_type == 'Phase change' and result.phase_type == 'Waiting to receive':
+            for status in reversed(self.jobs):
+                if status['did_print']:
+                    if not status['ready_for_next_job']:
+                        status['ready_for_next_job'] = True
+                        status['timings']['waiting_to_receive'] = self._elapsed(status)
+                    break
@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 
-import sys, argparse, logging, struct, io, logging, sys, os, time
+import sys, argparse, logging, struct, io, logging, sys, os, time, mmap
 from pprint import pprint, pformat
 
-from brother_ql.reader import OPCODES, chunker, merge_specific_instructions, interpret_response, match_opcode, hex_format
+from brother_ql.reader import OPCODES, chunker, merge_specific_instructions, PrinterStatus, match_opcode, hex_format
 from brother_ql.backends import backend_factory, guess_backend
 
 logger = logging.getLogger(__name__)
@@ -22,12 +22,13 @@ class BrotherQL_USBdebug(object):
         self.interactive = False
         self.merge_specific_instructions = True
         if type(instructions_data) in (str,):
+            # memory mapped: the instructions are sliced from the file without reading it completely
             with open(instructions_data, 'rb') as f:
-                self.instructions_data = f.read()
-        elif type(instructions_data) in (bytes,):
+                self.instructions_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        elif type(instructions_data) in (bytes, bytearray, memoryview, mmap.mmap):
             self.instructions_data = instructions_data
         else:
-            raise NotImplementedError('Only filename or bytes supported for instructions_data argument')
+            raise NotImplementedError('Only filename or bytes (or another buffer) supported for instructions_data argument')
         response = self.be.read()
         if response:
             logger.warning('Received response before sending instructions: {}'.format(hex_format(response)))
@@ -44,8 +45,9 @@ class BrotherQL_USBdebug(object):
 
     def log_interp_response(self, data):
         try:
-            interp_result = interpret_response(data)
-            logger.info("Interpretation of the response: '{status_type}' (phase: {phase_type}), '{media_type}' {media_width}x{media_length} mm^2, errors: {errors}".format(**interp_result))
+            status = PrinterStatus.decode(data)
+            logger.info("Interpretation of the response: '%s' (phase: %s), '%s' %dx%d mm^2, errors: %s", status.status_type,
+                        status.phase_type, status.media_type, status.media_width, status.media_length, list(status.errors))
         except:
             logger.error("Couln't interpret response: %s", hex_format(data))
 
@@ -7,7 +7,7 @@ Testing the packaged version of the Linux Kernel backend
 import argparse, logging, sys
 
 from brother_ql.backends import backend_factory, guess_backend, available_backends
-from brother_ql.backends.helpers import discover, send
+from brother_ql.backends.helpers import discover, send, send_file
 from brother_ql.output_helpers import log_discovered_devices, textual_description_discovered_devices
 
 logger = logging.getLogger(__name__)
@@ -29,15 +29,14 @@ def main():
     if not args.list_printers and not args.instruction_file:
         parser.error("the following arguments are required: instruction_file")
 
-    # Reading the instruction input file into content variable
+    # The instruction input file (memory mapped when sending, unless it is stdin)
     if args.instruction_file == '-':
         try:
             content = sys.stdin.buffer.read()
         except AttributeError:
             content = sys.stdin.read()
     else:
-        with open(args.instruction_file, 'rb') as f:
-            content = f.read()
+        content = None
 
     # Setting up the requested level of logging.
     level = logging.DEBUG if args.debug else logging.INFO
@@ -80,6 +79,9 @@ def main():
         identifier = args.printer
 
     # Finally, do the actual printing.
-    send(instructions=content, printer_identifier=identifier, backend_identifier=selected_backend, blocking=True)
+    if content is None:
+        send_file(args.instruction_file, printer_identifier=identifier, backend_identifier=selected_backend, blocking=True, pool=False)
+    else:
+        send(instructions=content, printer_identifier=identifier, backend_identifier=selected_backend, blocking=True, pool=False)
 
 if __name__ == "__main__": main()
@@ -0,0 +1,203 @@
+"""
+Caching of conversion results
+
+Converting the very same image with the very same settings always results
+in the very same instructions. The :py:class:`ConversionCache` stores the
+encoded raster lines of pages and complete instruction streams, keyed by a
+hash of the image content and of all parameters affecting the result, so
+that frequently reprinted labels don't have to be converted again.
+"""
+
+from builtins import bytes, str
+
+import hashlib
+import io
+import logging
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+def image_digest(image):
+    """
+    Computes a digest of the content of an image.
+
+    :param image: A filename, a file handle or an instance of Pillow's Image.
+    :returns: A tuple of the hex digest and the image to be used instead of the
+              original argument (file handles are read and replaced by an
+              in-memory copy).
+    """
+    h = hashlib.sha256()
+    if isinstance(image, Image.Image):
+        h.update('{} {}x{}'.format(image.mode, *image.size).encode('ascii'))
+        if image.mode == 'P':
+            h.update(bytes(image.getpalette() or []))
+        h.update(image.tobytes())
+    elif isinstance(image, str):
+        with io.open(image, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+    else:
+        data = image.read()
+        h.update(data)
+        image = io.BytesIO(data)
+    return h.hexdigest(), image
+
+def key_digest(*parts):
+    """ Combines the given parts (converted to strings) to a single hex digest """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(repr(part).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+class ConversionCache(object):
+    """
+    A least recently used cache for conversion results, held in memory
+    and optionally also in a directory on disk.
+
+    Both levels evict the least recently used entries once their total
+    size exceeds the configured limit. Instances can be shared between
+    threads.
+
+    :param int max_size: Maximum total size of the entries kept in memory (in bytes).
+    :param str directory: Directory to additionally store the entries in (optional).
+    :param int max_disk_size: Maximum total size of the entries in the directory (in bytes).
+    """
+
+    def __init__(self, max_size=64*1024*1024, directory=None, max_disk_size=512*1024*1024):
+        self.max_size = max_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, key):
+        """
+        :returns: The cached value for the key or None.
+        :rtype: bytes
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+                self.hits += 1
+                return value
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        """ Stores a value (bytes) for the key """
+        value = bytes(value)
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def clear(self):
+        """ Removes all entries from memory and from disk """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        for path, _ in self._disk_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_page(self, key):
+        """
+        :returns: A tuple of the number of raster lines and the encoded raster lines, or None.
+        """
+        value = self.get(key)
+        if value is None:
+            return None
+        return struct.unpack('<L', value[:4])[0], value[4:]
+
+    def put_page(self, key, rows, raster_instructions):
+        self.put(key, struct.pack('<L', rows) + raster_instructions)
+
+    def _memory_put(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        if len(value) > self.max_size:
+            return
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def _disk_get(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with io.open(path, 'rb') as f:
+                value = f.read()
+            # the modification time serves as the time of the last use
+            os.utime(path, None)
+            return value
+        except (IOError, OSError):
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.directory or len(value) > self.max_disk_size:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.rename(tmp_path, self._path(key))
+        except (IOError, OSError) as e:
+            logger.warning('Could not write to the cache directory %s: %s', self.directory, e)
+            return
+        self._disk_evict()
+
+    def _disk_entries(self):
+        if not self.directory:
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((path, os.stat(path)))
+            except OSError:
+                pass
+        return entries
+
+    def _disk_evict(self):
+        entries = self._disk_entries()
+        total = sum(st.st_size for _, st in entries)
+        if total <= self.max_disk_size:
+            return
+        entries.sort(key=lambda entry: entry[1].st_mtime)
+        for path, st in entries:
+            if total <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+                total -= st.st_size
+            except OSError:
+                pass
@@ -125,11 +125,14 @@ def env(ctx, *args, **kwargs):
 @click.option('-r', '--rotate', type=click.Choice(('auto', '0', '90', '180', '270')), default='auto', help='Rotate the image (counterclock-wise) by this amount of degrees.')
 @click.option('-t', '--threshold', type=float, default=70.0, help='The threshold value (in percent) to discriminate between black and white pixels.')
 @click.option('-d', '--dither', is_flag=True, help='Enable dithering when converting the image to b/w. If set, --threshold is meaningless.')
-@click.option('-c', '--compress', is_flag=True, help='Enable compression (if available with the model). Label creation can take slightly longer but the resulting instruction size is normally considerably smaller.')
+@click.option('-c', '--compress', is_flag=True, help='Enable compression (if available with the model). The resulting instruction size is normally considerably smaller.')
+@click.option('--zero-raster', is_flag=True, help='Transmit blank raster lines as single byte instructions (if available with the model). Reduces the instruction size considerably for labels with much white space.')
 @click.option('--red', is_flag=True, help='Create a label to be printed on black/red/white tape (only with QL-8xx series on DK-22251 labels). You must use this option when printing on black/red tape, even when not printing red.')
 @click.option('--600dpi', 'dpi_600', is_flag=True, help='Print with 600x300 dpi available on some models. Provide your image as 600x600 dpi; perpendicular to the feeding the image will be resized to 300dpi.')
 @click.option('--lq', is_flag=True, help='Print with low quality (faster). Default is high quality.')
 @click.option('--no-cut', is_flag=True, help="Don't cut the tape after printing the label.")
+@click.option('-w', '--workers', type=int, help='Rasterize multiple images in parallel using this many worker processes.')
+@click.option('--cache-dir', envvar='BROTHER_QL_CACHE_DIR', type=click.Path(file_okay=False), help='Directory to cache conversion results in. Reprinting the same images with the same options skips the conversion.')
 @click.pass_context
 def print_cmd(ctx, *args, **kwargs):
     """ Print a label of the provided IMAGE. """
@@ -143,16 +146,109 @@ def print_cmd(ctx, *args, **kwargs):
     qlr.exception_on_warning = True
     kwargs['cut'] = not kwargs['no_cut']
     del kwargs['no_cut']
+    cache_dir = kwargs.pop('cache_dir')
+    if cache_dir:
+        from brother_ql.cache import ConversionCache
+        kwargs['cache'] = ConversionCache(directory=cache_dir)
     instructions = convert(qlr=qlr, **kwargs)
-    send(instructions=instructions, printer_identifier=printer, backend_identifier=backend, blocking=True)
+    send(instructions=instructions, printer_identifier=printer, backend_identifier=backend, blocking=True, pool=False)
+
+@cli.command(short_help='Run a print spooler with an HTTP API')
+@click.option('-P', '--queue-printer', 'printers', multiple=True, metavar='[GROUP=]PRINTER_IDENTIFIER', help='A printer to serve (can be given multiple times). Printers with the same GROUP take turns printing the jobs submitted for the group. Defaults to the printer given via --printer.')
+@click.option('--host', default='127.0.0.1', help='The address to listen on.')
+@click.option('--port', type=int, default=8013, help='The port to listen on.')
+@click.option('--max-queue-size', type=int, default=100, help='The maximum number of jobs waiting per printer. Further jobs are rejected.')
+@click.pass_context
+def serve(ctx, *args, **kwargs):
+    """
+    Queue print jobs per printer and send them in the background.
+
+    Jobs are submitted via HTTP: POST /jobs?printer=PRINTER_OR_GROUP&priority=N
+    with the instructions as the request body. Their state can be queried via
+    GET /jobs/ID, the state of the printers via GET /printers.
+    """
+    from brother_ql.spooler import Spooler, SpoolerHTTPServer
+    backend = ctx.meta.get('BACKEND')
+    printers = kwargs['printers'] or [ctx.meta.get('PRINTER')]
+    if not all(printers):
+        raise click.UsageError('Specify the printers to serve via --queue-printer or --printer.')
+    spooler = Spooler(max_queue_size=kwargs['max_queue_size'])
+    for printer in printers:
+        # only a GROUP= prefix is split off, identifiers may contain '=' themselves
+        group, sep, identifier = printer.partition('=')
+        if not sep or '://' in group:
+            group, identifier = None, printer
+        spooler.add_printer(identifier, backend_identifier=backend, group=group or None)
+    spooler.start()
+    server = SpoolerHTTPServer(spooler, kwargs['host'], kwargs['port'])
+    logger.info('Serving on http://%s:%d/', kwargs['host'], kwargs['port'])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        spooler.stop()
+
+@cli.command(short_help='Emulate a printer for testing')
+@click.option('--tcp', 'tcp', metavar='[HOST:]PORT', help='Emulate a network printer listening on this address.')
+@click.option('--pty', 'pty', is_flag=True, help='Emulate a printer device file (a pseudo terminal). Its path is logged.')
+@click.option('--media-width', type=int, default=62, help='The width of the loaded media in mm.')
+@click.option('--speed', type=float, default=1.0, help='Factor applied to the print speed of the model. 0 prints instantly.')
+@click.option('--error-rate', type=float, default=0.0, help='The probability of a page failing with a random error.')
+@click.pass_context
+def emulate(ctx, *args, **kwargs):
+    """
+    Emulate a printer of the model given via --model: parse the instructions
+    received, simulate the printing time and answer with status messages.
+    """
+    from brother_ql.backends.emulator import serve_tcp, serve_pty
+    options = {
+      'model': ctx.meta.get('MODEL') or 'QL-700',
+      'media_width': kwargs['media_width'],
+      'speed': kwargs['speed'],
+      'error_rate': kwargs['error_rate'],
+    }
+    try:
+        if kwargs['pty']:
+            serve_pty(**options)
+        else:
+            host, _, port = (kwargs['tcp'] or '9100').rpartition(':')
+            serve_tcp(host or '127.0.0.1', int(port), **options)
+    except KeyboardInterrupt:
+        pass
 
 @cli.command(name='analyze', help='interpret a binary file containing raster instructions for the Brother QL-Series printers')
 @click.argument('instructions', type=click.File('rb'))
 @click.option('-f', '--filename-format', help="Filename format string. Default is: label{counter:04d}.png.")
+@click.option('-s', '--statistics', is_flag=True, help="Print statistics for every page instead of saving images of them.")
+@click.option('--format', 'output_format', type=click.Choice(('text', 'json', 'none')), default='text', help="How to output the instructions found and the pages: as text, as JSON (one object per line) or not at all (only saving the pages, quietly). Default is: text.")
 @click.pass_context
 def analyze_cmd(ctx, *args, **kwargs):
+    import json
     from brother_ql.reader import BrotherQLReader
-    br = BrotherQLReader(kwargs.get('instructions'))
+    output_format = kwargs.get('output_format')
+    statistics_only = kwargs.get('statistics')
+    # the instructions are output by the callbacks below, not by the reader's log messages
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.getLogger('brother_ql.reader').setLevel(logging.WARNING)
+    def instruction_callback(instruction):
+        if output_format == 'json':
+            print(json.dumps(dict(event='instruction', **instruction.to_dict())))
+        else:
+            print(instruction)
+    def page_callback(im, statistics):
+        img_name = None if statistics_only else br.save_page(im, statistics)
+        if output_format == 'none':
+            return
+        if output_format == 'json':
+            print(json.dumps(dict(event='page', filename=img_name, **statistics)))
+        elif statistics_only:
+            print(', '.join('{}: {}'.format(key, value) for key, value in sorted(statistics.items())))
+        else:
+            print('Page saved as {}'.format(img_name))
+    br = BrotherQLReader(kwargs.get('instructions'), page_callback=page_callback, render=not statistics_only,
+                         instruction_callback=instruction_callback if output_format != 'none' else None)
     if kwargs.get('filename_format'): br.filename_fmt = kwargs.get('filename_format')
     br.analyse()
 
@@ -160,8 +256,8 @@ def analyze_cmd(ctx, *args, **kwargs):
 @click.argument('instructions', type=click.File('rb'))
 @click.pass_context
 def send_cmd(ctx, *args, **kwargs):
-    from brother_ql.backends.helpers import send
-    send(instructions=kwargs['instructions'].read(), printer_identifier=ctx.meta.get('PRINTER'), backend_identifier=ctx.meta.get('BACKEND'), blocking=True)
+    from brother_ql.backends.helpers import send_file
+    send_file(kwargs['instructions'], printer_identifier=ctx.meta.get('PRINTER'), backend_identifier=ctx.meta.get('BACKEND'), blocking=True, pool=False)
 
 if __name__ == '__main__':
     cli()
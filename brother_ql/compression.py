@@ -0,0 +1,140 @@
+"""
+PackBits compression of raster lines
+
+The raster language of the Brother QL printers optionally transmits
+each raster line compressed with the PackBits run-length encoding
+(TIFF flavour). This module implements an encoder producing the very
+same output as the pure Python `packbits` package, but working on runs
+found by a regular expression instead of iterating over single bytes,
+and the matching decoder used by the reader.
+
+The central piece is :py:class:`PackBitsRowEncoder`, which adds the
+special cases and the memoization used when encoding a complete job.
+"""
+
+from builtins import bytes
+
+import re
+
+#: Runs of two or more identical bytes
+_RUNS = re.compile(b'(.)\\1+', re.DOTALL)
+
+#: Maximum length of a literal segment or a run (not at the end of the data)
+_MAX_LENGTH = 127
+
+def _add_literal(out, data, start, end, final):
+    # A literal segment reaching the end of the data may be one byte longer.
+    limit = _MAX_LENGTH + 1 if final else _MAX_LENGTH
+    while end - start > limit:
+        out.append(_MAX_LENGTH - 1)
+        out += data[start:start+_MAX_LENGTH]
+        start += _MAX_LENGTH
+    out.append(end - start - 1)
+    out += data[start:end]
+
+def _add_run(out, byte, length):
+    while length > _MAX_LENGTH + 1:
+        out.append(256 - (_MAX_LENGTH - 1))
+        out.append(byte)
+        length -= _MAX_LENGTH
+    out.append(256 - (length - 1))
+    out.append(byte)
+
+def packbits_encode(data):
+    """
+    Encodes data using PackBits encoding.
+
+    The result is byte-identical to the one of :py:func:`packbits.encode`.
+
+    :param bytes data: The data to be encoded
+    :rtype: bytes
+    """
+    data = bytes(data)
+    if len(data) == 0:
+        return data
+    if len(data) == 1:
+        return b'\x00' + data
+    out = bytearray()
+    literal_start = 0
+    for run in _RUNS.finditer(data):
+        start, end = run.span()
+        if start > literal_start:
+            _add_literal(out, data, literal_start, start, final=False)
+        _add_run(out, data[start], end - start)
+        literal_start = end
+    if literal_start < len(data):
+        _add_literal(out, data, literal_start, len(data), final=True)
+    return bytes(out)
+
+def packbits_decode(data):
+    """
+    Decodes PackBits encoded data.
+
+    Literal segments and runs are copied as a whole instead of byte by byte.
+    As in the reader so far, a header byte of 0x80 is taken as a run of 129 bytes.
+
+    :param bytes data: The data to be decoded
+    :rtype: bytes
+    """
+    data = bytes(data)
+    out = bytearray()
+    index, end = 0, len(data)
+    while index < end:
+        header = data[index]
+        if header & 0x80:
+            out += data[index+1:index+2] * (257 - header)
+            index += 2
+        else:
+            out += data[index+1:index+2+header]
+            index += 2 + header
+    return bytes(out)
+
+class PackBitsRowEncoder(object):
+    """
+    Encodes raster lines of a fixed length using PackBits.
+
+    Blank (all white) and full (all black) lines are answered from
+    precomputed encodings. All other lines are memoized, as barcodes,
+    frames and borders tend to repeat the very same lines many times
+    within a job.
+
+    :param int row_len: The length of the raster lines in bytes.
+    :param int max_cache_size: The number of distinct lines to memoize.
+                               When exceeded, the memo is cleared.
+    """
+
+    def __init__(self, row_len, max_cache_size=4096):
+        self.row_len = row_len
+        self.max_cache_size = max_cache_size
+        self._blank = bytes(row_len)
+        self._full = b'\xFF' * row_len
+        self._blank_encoded = packbits_encode(self._blank)
+        self._full_encoded = packbits_encode(self._full)
+        self._cache = {}
+
+    def encode(self, row):
+        """
+        :param row: The raster line (bytes, a bytearray or a memoryview).
+        :rtype: bytes
+        """
+        if isinstance(row, bytearray) or (isinstance(row, memoryview) and not row.readonly):
+            # writable buffers can't be hashed for the memo
+            row = bytes(row)
+        if row == self._blank:
+            return self._blank_encoded
+        if row == self._full:
+            return self._full_encoded
+        try:
+            return self._cache[row]
+        except KeyError:
+            pass
+        row = bytes(row)
+        encoded = packbits_encode(row)
+        if len(self._cache) >= self.max_cache_size:
+            self._cache.clear()
+        self._cache[row] = encoded
+        return encoded
+
+    def clear(self):
+        """ Forget all memoized lines (e.g. at the start of a new job) """
+        self._cache.clear()
@@ -4,15 +4,18 @@ from __future__ import division, unicode_literals
 from builtins import str
 
 import logging
+import functools
+from collections import deque
 
 from PIL import Image
 import PIL.ImageOps, PIL.ImageChops
 
-from brother_ql.raster import BrotherQLRaster
+from brother_ql.raster import BrotherQLRaster, JobProfile
 from brother_ql.devicedependent import ENDLESS_LABEL, DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL, PTOUCH_ENDLESS_LABEL
 from brother_ql.devicedependent import label_type_specs, right_margin_addition
 from brother_ql import BrotherQLUnsupportedCmd
-from brother_ql.image_trafos import filtered_hsv
+from brother_ql.image_trafos import separate_red_black, binary_frame, threshold_frame
+from brother_ql.cache import image_digest, key_digest
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,9 @@ logging.getLogger("PIL.PngImagePlugin").setLevel(logging.WARNING)
 def convert(qlr, images, label,  **kwargs):
     r"""Converts one or more images to a raster instruction file.
 
+    If `qlr` was created with a sink (e.g. a printer backend), the instructions
+    of every page are handed to it as soon as the page is rasterized.
+
     :param qlr:
         An instance of the BrotherQLRaster class
     :type qlr: :py:class:`brother_ql.raster.BrotherQLRaster`
@@ -38,30 +44,75 @@ def convert(qlr, images, label,  **kwargs):
         * **dither** (``bool``) --
           Instead of applying a threshold to the pixel values, approximate grey tones with dithering.
         * **compress**
+        * **zero_raster** (``bool``) --
+          Transmit blank raster lines as single byte 'zero raster' instructions (if supported by the model).
         * **red**
         * **rotate**
         * **dpi_600**
         * **hq**
         * **threshold**
+        * **workers** (``int``) --
+          Rasterize the pages in a pool of this many worker processes.
+        * **cache** (:py:class:`brother_ql.cache.ConversionCache`) --
+          Reuse the results of previous conversions of the same images with the same settings.
+          Complete instruction streams are cached if `images` is a list and `qlr` has no sink.
     """
-    label_specs = label_type_specs[label]
+    cache = kwargs.get('cache')
+    stream_key = None
+    if cache is not None and qlr.sink is None and isinstance(images, (list, tuple)):
+        digests = []
+        prepared = []
+        for image in images:
+            digest, image = image_digest(image)
+            digests.append(digest)
+            prepared.append(image)
+        images = prepared
+        stream_key = key_digest('stream', CACHE_FORMAT_VERSION, qlr.model, label, digests, sorted(_stream_options(kwargs).items()))
+        stream = cache.get(stream_key)
+        if stream is not None:
+            qlr.add_instructions(stream)
+            return qlr.data
+        kwargs['digests'] = digests
+        start = qlr.data_length
+    for _ in _convert_pages(qlr, images, label, **kwargs):
+        pass
+    data = qlr.data
+    if stream_key is not None:
+        cache.put(stream_key, data[start:])
+    return data
 
-    dots_printable = label_specs['dots_printable']
-    right_margin_dots = label_specs['right_margin_dots']
-    right_margin_dots += right_margin_addition.get(qlr.model, 0)
-    device_pixel_width = qlr.get_pixel_width()
+def convert_iter(qlr, images, label, **kwargs):
+    r"""Converts one or more images to raster instructions page by page.
+
+    This generator yields the instructions for each page as soon as the page is
+    rasterized (the first chunk also contains the preamble of the job). Together
+    with a lazy iterable of images, only a single page is held in memory at any
+    time. The chunks can directly be passed to the `write()` method of a backend
+    or to :py:func:`brother_ql.backends.helpers.send`.
+
+    The parameters are the same as for :py:func:`convert`. The instructions are
+    taken out of `qlr`, so it shouldn't be set up with a sink.
+
+    :rtype: generator of bytes
+    """
+    for _ in _convert_pages(qlr, images, label, **kwargs):
+        yield qlr.pop_data()
+
+def _convert_pages(qlr, images, label, **kwargs):
+    """
+    Adds the instructions for the images to `qlr`, yielding after each page.
+    """
+    label_specs = label_type_specs[label]
 
     cut = kwargs.get('cut', True)
-    dither = kwargs.get('dither', False)
     compress = kwargs.get('compress', False)
+    zero_raster = kwargs.get('zero_raster', False)
     red = kwargs.get('red', False)
-    rotate = kwargs.get('rotate', 'auto')
-    if rotate != 'auto': rotate = int(rotate)
     dpi_600 = kwargs.get('dpi_600', False)
     hq = kwargs.get('hq', True)
-    threshold = kwargs.get('threshold', 70)
-    threshold = 100.0 - threshold
-    threshold = min(255, max(0, int(threshold/100.0 * 255)))
+    workers = kwargs.get('workers', None)
+    cache = kwargs.get('cache', None)
+    options = _raster_options(kwargs)
 
     if red and not qlr.two_color_support:
         raise BrotherQLUnsupportedCmd('Printing in red is not supported with the selected model.')
@@ -77,123 +128,279 @@ def convert(qlr, images, label,  **kwargs):
     except BrotherQLUnsupportedCmd:
         pass
 
-    for image in images:
-        if isinstance(image, Image.Image):
-            im = image
-        else:
-            try:
-                im = Image.open(image)
-            except:
-                raise NotImplementedError("The image argument needs to be an Image() instance, the filename to an image, or a file handle.")
-
-        if im.mode.endswith('A'):
-            # place in front of white background and get red of transparency
-            bg = Image.new("RGB", im.size, (255,255,255))
-            bg.paste(im, im.split()[-1])
-            im = bg
-        elif im.mode == "P":
-            # Convert GIF ("P") to RGB
-            im = im.convert("RGB" if red else "L")
-        elif im.mode == "L" and red:
-            # Convert greyscale to RGB if printing on black/red tape
-            im = im.convert("RGB")
+    # the pages are either yielded as images or as already encoded raster instructions
+    encoded = bool(cache is not None or (workers and workers > 1))
+    if encoded:
+        pages = _encode_pages(qlr.model, images, label, options, workers, cache, kwargs.get('digests'))
+    else:
+        pages = (_rasterize_image(_open_image(image, red), qlr.model, label, **options) for image in images)
 
-        if dpi_600:
-            dots_expected = [el*2 for el in dots_printable]
+    row_len = qlr.get_pixel_width()//8
+    for page in pages:
+        if encoded:
+            rows, raster_instructions = page
         else:
-            dots_expected = dots_printable
-
-        if label_specs['kind'] in (ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL):
-            if rotate not in ('auto', 0):
-                im = im.rotate(rotate, expand=True)
-            if dpi_600:
-                im = im.resize((im.size[0]//2, im.size[1]))
-            if im.size[0] != dots_printable[0]:
-                hsize = int((dots_printable[0] / im.size[0]) * im.size[1])
-                im = im.resize((dots_printable[0], hsize), Image.ANTIALIAS)
-                logger.warning('Need to resize the image...')
-            if im.size[0] < device_pixel_width:
-                new_im = Image.new(im.mode, (device_pixel_width, im.size[1]), (255,)*len(im.mode))
-                new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
-                im = new_im
-        elif label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
-            if rotate == 'auto':
-                if im.size[0] == dots_expected[1] and im.size[1] == dots_expected[0]:
-                    im = im.rotate(90, expand=True)
-            elif rotate != 0:
-                im = im.rotate(rotate, expand=True)
-            if im.size[0] != dots_expected[0] or im.size[1] != dots_expected[1]:
-                raise ValueError("Bad image dimensions: %s. Expecting: %s." % (im.size, dots_expected))
-            if dpi_600:
-                im = im.resize((im.size[0]//2, im.size[1]))
-            new_im = Image.new(im.mode, (device_pixel_width, dots_expected[1]), (255,)*len(im.mode))
-            new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
-            im = new_im
+            frames = page
+            rows = len(frames[0]) // row_len
 
-        if red:
-            filter_h = lambda h: 255 if (h <  40 or h > 210) else 0
-            filter_s = lambda s: 255 if s > 100 else 0
-            filter_v = lambda v: 255 if v >  80 else 0
-            red_im = filtered_hsv(im, filter_h, filter_s, filter_v)
-            red_im = red_im.convert("L")
-            red_im = PIL.ImageOps.invert(red_im)
-            red_im = red_im.point(lambda x: 0 if x < threshold else 255, mode="1")
-
-            filter_h = lambda h: 255
-            filter_s = lambda s: 255
-            filter_v = lambda v: 255 if v <  80 else 0
-            black_im = filtered_hsv(im, filter_h, filter_s, filter_v)
-            black_im = black_im.convert("L")
-            black_im = PIL.ImageOps.invert(black_im)
-            black_im = black_im.point(lambda x: 0 if x < threshold else 255, mode="1")
-            black_im = PIL.ImageChops.subtract(black_im, red_im)
-        else:
-            im = im.convert("L")
-            im = PIL.ImageOps.invert(im)
-
-            if dither:
-                im = im.convert("1", dither=Image.FLOYDSTEINBERG)
-            else:
-                im = im.point(lambda x: 0 if x < threshold else 255, mode="1")
-
-        qlr.add_status_information()
-        tape_size = label_specs['tape_size']
-        if label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
-            qlr.mtype = 0x0B
-            qlr.mwidth = tape_size[0]
-            qlr.mlength = tape_size[1]
-        elif label_specs['kind'] in (ENDLESS_LABEL, ):
-            qlr.mtype = 0x0A
-            qlr.mwidth = tape_size[0]
-            qlr.mlength = 0
-        elif label_specs['kind'] in (PTOUCH_ENDLESS_LABEL, ):
-            qlr.mtype = 0x00
-            qlr.mwidth = tape_size[0]
-            qlr.mlength = 0
-        qlr.pquality = int(hq)
-        qlr.add_media_and_quality(im.size[1])
+        profile_key = (qlr.model, label, cut, dpi_600, bool(red), hq, compress, zero_raster)
+        profile = _job_profiles.get(profile_key)
+        if profile is None:
+            add_header = functools.partial(_add_page_header, label_specs=label_specs, cut=cut, dpi_600=dpi_600,
+                                           red=red, hq=hq, compress=compress, zero_raster=zero_raster)
+            profile = _job_profiles[profile_key] = JobProfile(qlr.model, add_header)
         try:
-            if cut:
-                qlr.add_autocut(True)
-                qlr.add_cut_every(1)
+            qlr.add_job_profile(profile, rows)
         except BrotherQLUnsupportedCmd:
             pass
-        try:
-            qlr.dpi_600 = dpi_600
-            qlr.cut_at_end = cut
-            qlr.two_color_printing = True if red else False
-            qlr.add_expanded_mode()
-        except BrotherQLUnsupportedCmd:
-            pass
-        qlr.add_margins(label_specs['feed_margin'])
-        try:
-            if compress: qlr.add_compression(True)
-        except BrotherQLUnsupportedCmd:
-            pass
-        if red:
-            qlr.add_raster_data(black_im, red_im)
+        if encoded:
+            qlr.add_raster_instructions(raster_instructions)
         else:
-            qlr.add_raster_data(im)
+            qlr.add_packed_raster_data(*frames)
         qlr.add_print()
+        yield
+
+#: The format of the cached conversion results, part of all cache keys.
+#: Increase it whenever the instructions created change, so that caches
+#: on disk don't return results of an older version.
+CACHE_FORMAT_VERSION = 1
+
+#: The compiled page headers: (model, label, cut, dpi_600, red, hq, compress, zero_raster) -> JobProfile
+_job_profiles = {}
+
+def _add_page_header(qlr, label_specs, cut, dpi_600, red, hq, compress, zero_raster, rows=0):
+    """
+    Adds the instructions preceding the raster lines of a page.
+    """
+    qlr.add_status_information()
+    tape_size = label_specs['tape_size']
+    if label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
+        qlr.mtype = 0x0B
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = tape_size[1]
+    elif label_specs['kind'] in (ENDLESS_LABEL, ):
+        qlr.mtype = 0x0A
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = 0
+    elif label_specs['kind'] in (PTOUCH_ENDLESS_LABEL, ):
+        qlr.mtype = 0x00
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = 0
+    qlr.pquality = int(hq)
+    qlr.add_media_and_quality(rows)
+    try:
+        if cut:
+            qlr.add_autocut(True)
+            qlr.add_cut_every(1)
+    except BrotherQLUnsupportedCmd:
+        pass
+    try:
+        qlr.dpi_600 = dpi_600
+        qlr.cut_at_end = cut
+        qlr.two_color_printing = True if red else False
+        qlr.add_expanded_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+    qlr.add_margins(label_specs['feed_margin'])
+    try:
+        if compress: qlr.add_compression(True)
+    except BrotherQLUnsupportedCmd:
+        pass
+    try:
+        if zero_raster: qlr.zero_raster = True
+    except BrotherQLUnsupportedCmd:
+        pass
 
-    return qlr.data
+def _raster_options(kwargs):
+    """
+    Extracts the options affecting the raster image of a page from the convert() kwargs.
+    """
+    rotate = kwargs.get('rotate', 'auto')
+    if rotate != 'auto': rotate = int(rotate)
+    threshold = kwargs.get('threshold', 70)
+    threshold = 100.0 - threshold
+    threshold = min(255, max(0, int(threshold/100.0 * 255)))
+    return {
+      'rotate': rotate,
+      'threshold': threshold,
+      'dither': kwargs.get('dither', False),
+      'red': kwargs.get('red', False),
+      'dpi_600': kwargs.get('dpi_600', False),
+      'compress': kwargs.get('compress', False),
+      'zero_raster': kwargs.get('zero_raster', False),
+    }
+
+def _stream_options(kwargs):
+    """
+    All options of convert() affecting the resulting instructions (with their defaults).
+    """
+    options = _raster_options(kwargs)
+    options.update({
+      'cut': kwargs.get('cut', True),
+      'hq': kwargs.get('hq', True),
+    })
+    return options
+
+def _open_image(image, red=False):
+    """
+    Returns the image as Pillow Image instance in a mode suitable for further processing.
+    """
+    if isinstance(image, Image.Image):
+        im = image
+    else:
+        try:
+            im = Image.open(image)
+        except:
+            raise NotImplementedError("The image argument needs to be an Image() instance, the filename to an image, or a file handle.")
+
+    if im.mode.endswith('A'):
+        # place in front of white background and get red of transparency
+        bg = Image.new("RGB", im.size, (255,255,255))
+        bg.paste(im, im.split()[-1])
+        im = bg
+    elif im.mode == "P":
+        # Convert GIF ("P") to RGB
+        im = im.convert("RGB" if red else "L")
+    elif im.mode == "L" and red:
+        # Convert greyscale to RGB if printing on black/red tape
+        im = im.convert("RGB")
+    return im
+
+def _rasterize_image(im, model, label, rotate, threshold, dither, red, dpi_600, **kwargs):
+    """
+    Turns an image into the frame(s) to be printed.
+
+    :returns: A list of the packed black layer and (if printing in red) the packed red layer.
+    """
+    label_specs = label_type_specs[label]
+    dots_printable = label_specs['dots_printable']
+    right_margin_dots = label_specs['right_margin_dots']
+    right_margin_dots += right_margin_addition.get(model, 0)
+    device_pixel_width = BrotherQLRaster(model).get_pixel_width()
+
+    if dpi_600:
+        dots_expected = [el*2 for el in dots_printable]
+    else:
+        dots_expected = dots_printable
+
+    if label_specs['kind'] in (ENDLESS_LABEL, PTOUCH_ENDLESS_LABEL):
+        if rotate not in ('auto', 0):
+            im = im.rotate(rotate, expand=True)
+        if dpi_600:
+            im = im.resize((im.size[0]//2, im.size[1]))
+        if im.size[0] != dots_printable[0]:
+            hsize = int((dots_printable[0] / im.size[0]) * im.size[1])
+            im = im.resize((dots_printable[0], hsize), Image.ANTIALIAS)
+            logger.warning('Need to resize the image...')
+        if im.size[0] < device_pixel_width:
+            new_im = Image.new(im.mode, (device_pixel_width, im.size[1]), (255,)*len(im.mode))
+            new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
+            im = new_im
+    elif label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
+        if rotate == 'auto':
+            if im.size[0] == dots_expected[1] and im.size[1] == dots_expected[0]:
+                im = im.rotate(90, expand=True)
+        elif rotate != 0:
+            im = im.rotate(rotate, expand=True)
+        if im.size[0] != dots_expected[0] or im.size[1] != dots_expected[1]:
+            raise ValueError("Bad image dimensions: %s. Expecting: %s." % (im.size, dots_expected))
+        if dpi_600:
+            im = im.resize((im.size[0]//2, im.size[1]))
+        new_im = Image.new(im.mode, (device_pixel_width, dots_expected[1]), (255,)*len(im.mode))
+        new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
+        im = new_im
+
+    if red:
+        black_im, red_im = separate_red_black(im)
+        red_im = red_im.convert("L")
+        red_im = PIL.ImageOps.invert(red_im)
+        red_im = red_im.point(lambda x: 0 if x < threshold else 255, mode="1")
+
+        black_im = black_im.convert("L")
+        black_im = PIL.ImageOps.invert(black_im)
+        black_im = black_im.point(lambda x: 0 if x < threshold else 255, mode="1")
+        black_im = PIL.ImageChops.subtract(black_im, red_im)
+        return [binary_frame(black_im), binary_frame(red_im)]
+    elif dither:
+        im = im.convert("L")
+        im = PIL.ImageOps.invert(im)
+        im = im.convert("1", dither=Image.FLOYDSTEINBERG)
+        return [binary_frame(im)]
+    else:
+        return [threshold_frame(im, threshold)]
+
+def _encode_page(job):
+    """
+    Rasterizes and encodes a single page. Executed in the worker processes.
+
+    :param tuple job: (image, model, label, options)
+    :returns: A tuple of the number of raster lines and the raster line instructions.
+    """
+    image, model, label, options = job
+    frames = _rasterize_image(_open_image(image, options['red']), model, label, **options)
+    qlr = BrotherQLRaster(model)
+    qlr.exception_on_warning = True
+    try:
+        if options['compress']: qlr.add_compression(True)
+    except BrotherQLUnsupportedCmd:
+        pass
+    try:
+        if options['zero_raster']: qlr.zero_raster = True
+    except BrotherQLUnsupportedCmd:
+        pass
+    qlr.pop_data()
+    qlr.add_packed_raster_data(*frames)
+    return len(frames[0]) // (qlr.get_pixel_width()//8), qlr.pop_data()
+
+def _encode_pages(model, images, label, options, workers=None, cache=None, digests=None):
+    """
+    Rasterizes and encodes the pages, optionally in a pool of worker processes
+    and/or reusing results from a cache.
+
+    The results are yielded in the order of the images. Only a limited number
+    of pages is in flight at any time, so lazy iterables of images stay lazy.
+
+    :returns: A generator of tuples (number of raster lines, raster line instructions).
+    """
+    executor = None
+    if workers and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    # entries: (cache key of a page to be stored, future, result)
+    pending = deque()
+    def resolve(entry):
+        key, future, page = entry
+        if future is not None:
+            page = future.result()
+        if key is not None:
+            cache.put_page(key, *page)
+        return page
+    try:
+        for index, image in enumerate(images):
+            key = None
+            if cache is not None:
+                if digests:
+                    digest = digests[index]
+                else:
+                    digest, image = image_digest(image)
+                key = key_digest('page', CACHE_FORMAT_VERSION, model, label, digest, sorted(options.items()))
+                page = cache.get_page(key)
+                if page is not None:
+                    pending.append((None, None, page))
+                    key = None
+            if key is not None or cache is None:
+                if executor is None:
+                    pending.append((key, None, _encode_page((image, model, label, options))))
+                else:
+                    if not isinstance(image, (str, Image.Image)):
+                        # file handles cannot be passed to other processes
+                        image = _open_image(image, options['red'])
+                        image.load()
+                    pending.append((key, executor.submit(_encode_page, (image, model, label, options)), None))
+            while pending and (pending[0][1] is None or len(pending) >= 2 * workers):
+                yield resolve(pending.popleft())
+        while pending:
+            yield resolve(pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown()
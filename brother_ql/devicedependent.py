@@ -35,6 +35,7 @@ cuttingsupport = []
 expandedmode = []
 compressionsupport = []
 two_color_support = []
+zerorastersupport = []
 
 ## Let's recreate them using the improved data structures
 ## in brother_ql.models and brother_ql.labels
@@ -43,7 +44,7 @@ def _populate_model_legacy_structures():
     from brother_ql.models import ModelsManager
     global models
     global min_max_length_dots, min_max_feed, number_bytes_per_row, right_margin_addition
-    global modesetting, cuttingsupport, expandedmode, compressionsupport, two_color_support
+    global modesetting, cuttingsupport, expandedmode, compressionsupport, two_color_support, zerorastersupport
 
     for model in ModelsManager().iter_elements():
         models.append(model.identifier)
@@ -56,6 +57,7 @@ def _populate_model_legacy_structures():
         if model.expanded_mode: expandedmode.append(model.identifier)
         if model.compression: compressionsupport.append(model.identifier)
         if model.two_color: two_color_support.append(model.identifier)
+        if model.zero_raster: zerorastersupport.append(model.identifier)
 
 def _populate_label_legacy_structures():
     """
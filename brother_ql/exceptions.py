@@ -10,3 +10,9 @@ class BrotherQLUnknownModel(BrotherQLError):
 
 class BrotherQLRasterError(BrotherQLError):
     pass
+
+class BrotherQLSpoolerError(BrotherQLError):
+    pass
+
+class BrotherQLQueueFull(BrotherQLSpoolerError):
+    pass
@@ -1,23 +1,95 @@
-from PIL import Image
+from PIL import Image, ImageChops
 import colorsys
 
-def filtered_hsv(im, filter_h, filter_s, filter_v, default_col=(255,255,255)):
-    """ https://stackoverflow.com/a/22237709/183995 """
+#: The lookup tables of threshold_frame() by threshold
+_threshold_luts = {}
+
+def binary_frame(im):
+    """
+    Packs a binary image into a frame as transmitted to the printer:
+    mirrored horizontally, 8 pixels per byte, 1 bits for black pixels.
+
+    :param PIL.Image.Image im: An image of mode "1" with 0 (black) for pixels to be left blank.
+    :rtype: bytes
+    """
+    im = im.transpose(Image.FLIP_LEFT_RIGHT)
+    return bytes(im.convert("1").tobytes(encoder_name='raw'))
 
-    hsv_im = im.convert('HSV')
-    H, S, V = 0, 1, 2
-    hsv = hsv_im.split()
-    mask_h = hsv[H].point(filter_h)
-    mask_s = hsv[S].point(filter_s)
-    mask_v = hsv[V].point(filter_v)
+def threshold_frame(im, threshold):
+    """
+    Converts an image to a frame as transmitted to the printer (see :py:func:`binary_frame`):
+    inverting, thresholding, mirroring and bit-packing are fused into a lookup
+    table and a single transposition.
 
-    Mdat = []
-    for h, s, v in zip(mask_h.getdata(), mask_s.getdata(), mask_v.getdata()):
-        Mdat.append(255 if (h and s and v) else 0)
+    The result equals ``binary_frame(invert(im.convert("L")).point(lambda x: 0 if x < threshold else 255, mode="1"))``.
 
-    mask = mask_h
-    mask.putdata(Mdat)
+    :param PIL.Image.Image im: The image to be converted
+    :param int threshold: Pixels darker than 255 - threshold are printed.
+    :rtype: bytes
+    """
+    lut = _threshold_luts.get(threshold)
+    if lut is None:
+        lut = _threshold_luts[threshold] = [0 if 255 - value < threshold else 255 for value in range(256)]
+    if im.mode != "L":
+        im = im.convert("L")
+    im = im.transpose(Image.FLIP_LEFT_RIGHT)
+    return bytes(im.point(lut, mode="1").tobytes(encoder_name='raw'))
 
+def _boolean_lut(band_filter):
+    """ Lookup table mapping the pixel values for which `band_filter` is truthy to 255, others to 0 """
+    if callable(band_filter):
+        return [255 if band_filter(value) else 0 for value in range(256)]
+    return [255 if band_filter[value] else 0 for value in range(256)]
+
+def _hsv_mask(hsv, filter_h, filter_s, filter_v):
+    """
+    Combines the filters applied to the bands of an HSV image to a single mask.
+    A filter can be None to accept all values of the band.
+    """
+    mask = None
+    for band, band_filter in zip(hsv, (filter_h, filter_s, filter_v)):
+        if band_filter is None:
+            continue
+        band_mask = band.point(_boolean_lut(band_filter))
+        # 255 * 255 / 255 = 255, any product with 0 is 0: a logical 'and' of the masks
+        mask = band_mask if mask is None else ImageChops.multiply(mask, band_mask)
+    if mask is None:
+        mask = Image.new('L', hsv[0].size, 255)
+    return mask
+
+def _masked(im, mask, default_col=(255,255,255)):
     filtered_im = Image.new("RGB", im.size, color=default_col)
     filtered_im.paste(im, None, mask)
     return filtered_im
+
+def filtered_hsv(im, filter_h, filter_s, filter_v, default_col=(255,255,255)):
+    """
+    https://stackoverflow.com/a/22237709/183995
+
+    Keeps the pixels of `im` whose hue, saturation and value pass the
+    filters (callables or lookup tables of 256 entries) and replaces
+    all others with `default_col`.
+    """
+
+    hsv = im.convert('HSV').split()
+    mask = _hsv_mask(hsv, filter_h, filter_s, filter_v)
+    return _masked(im, mask, default_col)
+
+def separate_red_black(im, red_hue=(40, 210), red_saturation=100, red_value=80, black_value=80):
+    """
+    Separates an RGB image into the layers to be printed in black and in red.
+
+    A pixel is considered red if its hue is below ``red_hue[0]`` or above ``red_hue[1]``,
+    its saturation is above `red_saturation` and its value is above `red_value`.
+    A pixel is considered black if its value is below `black_value`.
+    All values are in the range 0-255 as used by Pillow's HSV mode.
+
+    :returns: A tuple (black_im, red_im) of RGB images keeping the respective pixels of `im` on a white background.
+    """
+    hsv = im.convert('HSV').split()
+    red_mask = _hsv_mask(hsv,
+                         lambda h: h < red_hue[0] or h > red_hue[1],
+                         lambda s: s > red_saturation,
+                         lambda v: v > red_value)
+    black_mask = _hsv_mask(hsv, None, None, lambda v: v < black_value)
+    return _masked(im, black_mask), _masked(im, red_mask)
@@ -35,6 +35,9 @@ class Model(object):
     #: Support for two color printing (black/red/white)
     #: available only on some newer models.
     two_color = attrib(type=bool, default=False)
+    #: Support for the 'zero raster' opcode (0x5A) transmitting
+    #: a blank raster line as a single byte.
+    zero_raster = attrib(type=bool, default=False)
 
     @property
     def name(self):
@@ -50,13 +53,13 @@ ALL_MODELS = [
   Model('QL-700',   (150, 11811), compression=False, mode_setting=False),
   Model('QL-710W',  (150, 11811)),
   Model('QL-720NW', (150, 11811)),
-  Model('QL-800',   (150, 11811), two_color=True, compression=False),
-  Model('QL-810W',  (150, 11811), two_color=True),
-  Model('QL-820NWB',(150, 11811), two_color=True),
+  Model('QL-800',   (150, 11811), two_color=True, compression=False, zero_raster=True),
+  Model('QL-810W',  (150, 11811), two_color=True, zero_raster=True),
+  Model('QL-820NWB',(150, 11811), two_color=True, zero_raster=True),
   Model('QL-1050',  (295, 35433), number_bytes_per_row=162, additional_offset_r=44),
   Model('QL-1060N', (295, 35433), number_bytes_per_row=162, additional_offset_r=44),
-  Model('PT-P750W',  (31, 14172), number_bytes_per_row=16),
-  Model('PT-P900W',  (57, 28346), number_bytes_per_row=70),
+  Model('PT-P750W',  (31, 14172), number_bytes_per_row=16, zero_raster=True),
+  Model('PT-P900W',  (57, 28346), number_bytes_per_row=70, zero_raster=True),
 ]
 
 class ModelsManager(ElementsManager):
@@ -11,10 +11,9 @@ from builtins import bytes
 
 import struct
 import logging
+import re
 
-import packbits
-from PIL import Image
-import io
+from PIL import Image, ImageChops
 
 from .devicedependent import models, \
                              min_max_feed, \
@@ -24,17 +23,18 @@ from .devicedependent import models, \
                              cuttingsupport, \
                              expandedmode, \
                              two_color_support, \
+                             zerorastersupport, \
                              modesetting
 
+from .compression import PackBitsRowEncoder
+from .image_trafos import binary_frame
 from . import BrotherQLError, BrotherQLUnsupportedCmd, BrotherQLUnknownModel, BrotherQLRasterError
 
-try:
-    from io import BytesIO
-except: # Py2
-    from cStringIO import StringIO as BytesIO
-
 logger = logging.getLogger(__name__)
 
+#: Lookup table mapping every non-zero byte to 255 (used to detect blank raster lines)
+_NONZERO_LUT = [0] + [255] * 255
+
 class BrotherQLRaster(object):
 
     """
@@ -46,25 +46,82 @@ class BrotherQLRaster(object):
     Instatiate the class by providing the printer
     model as argument.
 
-    :param str model: Choose from the list of available models.
+    Instead of collecting all instructions in memory, they can be handed
+    to a *sink* page by page while they are being produced (see :py:meth:`flush`).
 
-    :ivar bytes data: The resulting bytecode with all instructions.
+    :param str model: Choose from the list of available models.
+    :param sink: Optional destination of the instructions. Either a bytearray
+                 (the instructions are appended to it directly), an object with
+                 a `write()` method (e.g. an open file or a printer backend) or
+                 a callable accepting bytes (e.g. the `send` method of a generator).
+
+    :ivar bytes data: The resulting bytecode with all instructions. If a `write()`
+                      or callable sink is used, it only contains the instructions
+                      not yet handed to the sink.
     :ivar bool exception_on_warning: If set to True, an exception is raised if trying to add instruction which are not supported on the selected model. If set to False, the instruction is simply ignored and a warning sent to logging/stderr.
     """
 
-    def __init__(self, model='QL-500'):
+    def __init__(self, model='QL-500', sink=None):
         if model not in models:
             raise BrotherQLUnknownModel()
         self.model = model
-        self.data = b''
+        if isinstance(sink, bytearray):
+            self._buffer = sink
+            self._sink = None
+        else:
+            self._buffer = bytearray()
+            self._sink = sink
         self._pquality = True
         self.page_number = 0
         self.cut_at_end = True
         self.dpi_600 = False
         self.two_color_printing = False
         self._compression = False
+        self._zero_raster = False
+        self._row_encoders = {}
         self.exception_on_warning = False
 
+    @property
+    def data(self):
+        return bytes(self._buffer)
+
+    @data.setter
+    def data(self, value):
+        self._buffer[:] = value
+
+    @property
+    def data_length(self):
+        """ The number of bytes in :py:attr:`data` (without copying them) """
+        return len(self._buffer)
+
+    @property
+    def sink(self):
+        """ The sink the instructions are handed to (None if they are only collected in :py:attr:`data`) """
+        return self._sink
+
+    def pop_data(self):
+        """
+        Returns the instructions collected so far and removes them from :py:attr:`data`.
+
+        :rtype: bytes
+        """
+        chunk = bytes(self._buffer)
+        del self._buffer[:]
+        return chunk
+
+    def flush(self):
+        """
+        Hands the instructions collected so far to the sink (if any).
+        This is done automatically at the end of every page by :py:meth:`add_print`.
+        """
+        if self._sink is None or not self._buffer:
+            return
+        chunk = self.pop_data()
+        if hasattr(self._sink, 'write'):
+            self._sink.write(chunk)
+        else:
+            self._sink(chunk)
+
     def _warn(self, problem, kind=BrotherQLRasterError):
         """
         Logs the warning message `problem` or raises a
@@ -95,11 +152,12 @@ class BrotherQLRaster(object):
 
     def add_initialize(self):
         self.page_number = 0
-        self.data += b'\x1B\x40' # ESC @
+        self._row_encoders.clear()
+        self._buffer += b'\x1B\x40' # ESC @
 
     def add_status_information(self):
         """ Status Information Request """
-        self.data += b'\x1B\x69\x53' # ESC i S
+        self._buffer += b'\x1B\x69\x53' # ESC i S
 
     def add_switch_mode(self):
         """
@@ -110,11 +168,11 @@ class BrotherQLRaster(object):
         if self.model not in modesetting:
             self._unsupported("Trying to switch the operating mode on a printer that doesn't support the command.")
             return
-        self.data += b'\x1B\x69\x61\x01' # ESC i a
+        self._buffer += b'\x1B\x69\x61\x01' # ESC i a
 
     def add_invalidate(self):
         """ clear command buffer """
-        self.data += b'\x00' * 200
+        self._buffer += b'\x00' * 200
 
     @property
     def mtype(self): return self._mtype
@@ -145,33 +203,33 @@ class BrotherQLRaster(object):
         self._pquality = bool(value)
 
     def add_media_and_quality(self, rnumber):
-        self.data += b'\x1B\x69\x7A' # ESC i z
+        self._buffer += b'\x1B\x69\x7A' # ESC i z
         valid_flags = 0x80
         valid_flags |= (self._mtype is not None) << 1
         valid_flags |= (self._mwidth is not None) << 2
         valid_flags |= (self._mlength is not None) << 3
         valid_flags |= self._pquality << 6
-        self.data += bytes([valid_flags])
+        self._buffer += bytes([valid_flags])
         vals = [self._mtype, self._mwidth, self._mlength]
-        self.data += b''.join(b'\x00' if val is None else val for val in vals)
-        self.data += struct.pack('<L', rnumber)
-        self.data += bytes([0 if self.page_number == 0 else 1])
-        self.data += b'\x00'
+        self._buffer += b''.join(b'\x00' if val is None else val for val in vals)
+        self._buffer += struct.pack('<L', rnumber)
+        self._buffer += bytes([0 if self.page_number == 0 else 1])
+        self._buffer += b'\x00'
         # INFO:  media/quality (1B 69 7A) --> found! (payload: 8E 0A 3E 00 D2 00 00 00 00 00)
 
     def add_autocut(self, autocut = False):
         if self.model not in cuttingsupport:
             self._unsupported("Trying to call add_autocut with a printer that doesn't support it")
             return
-        self.data += b'\x1B\x69\x4D' # ESC i M
-        self.data += bytes([autocut << 6])
+        self._buffer += b'\x1B\x69\x4D' # ESC i M
+        self._buffer += bytes([autocut << 6])
 
     def add_cut_every(self, n=1):
         if self.model not in cuttingsupport:
             self._unsupported("Trying to call add_cut_every with a printer that doesn't support it")
             return
-        self.data += b'\x1B\x69\x41' # ESC i A
-        self.data += bytes([n & 0xFF])
+        self._buffer += b'\x1B\x69\x41' # ESC i A
+        self._buffer += bytes([n & 0xFF])
 
     def add_expanded_mode(self):
         if self.model not in expandedmode:
@@ -180,16 +238,16 @@ class BrotherQLRaster(object):
         if self.two_color_printing and not self.two_color_support:
             self._unsupported("Trying to set two_color_printing in expanded mode on a printer that doesn't support it.")
             return
-        self.data += b'\x1B\x69\x4B' # ESC i K
+        self._buffer += b'\x1B\x69\x4B' # ESC i K
         flags = 0x00
         flags |= self.cut_at_end << 3
         flags |= self.dpi_600 << 6
         flags |= self.two_color_printing << 0
-        self.data += bytes([flags])
+        self._buffer += bytes([flags])
 
     def add_margins(self, dots=0x23):
-        self.data += b'\x1B\x69\x64' # ESC i d
-        self.data += struct.pack('<H', dots)
+        self._buffer += b'\x1B\x69\x64' # ESC i d
+        self._buffer += struct.pack('<H', dots)
 
     def add_compression(self, compression=True):
         """
@@ -204,8 +262,26 @@ class BrotherQLRaster(object):
             self._unsupported("Trying to set compression on a printer that doesn't support it")
             return
         self._compression = compression
-        self.data += b'\x4D' # M
-        self.data += bytes([compression << 1])
+        self._buffer += b'\x4D' # M
+        self._buffer += bytes([compression << 1])
+
+    @property
+    def zero_raster(self):
+        """
+        Whether blank raster lines are transmitted using the single byte
+        'zero raster' instruction (0x5A) instead of a full raster line.
+        Not all models support this. Trying to enable it on a model that
+        doesn't, either issues a warning or raises an exception depending
+        on the value of :py:attr:`exception_on_warning`.
+        """
+        return self._zero_raster
+
+    @zero_raster.setter
+    def zero_raster(self, value):
+        if value and self.model not in zerorastersupport:
+            self._unsupported("Trying to enable zero raster lines on a printer that doesn't support them")
+            return
+        self._zero_raster = bool(value)
 
     def get_pixel_width(self):
         try:
@@ -233,36 +309,224 @@ class BrotherQLRaster(object):
                 fmt = "First and second image don't have the same dimesions: {} vs {}."
                 raise BrotherQLRasterError(fmt.format(image.size, second_image.size))
             images.append(second_image)
-        frames = []
-        for image in images:
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-            image = image.convert("1")
-            frames.append(bytes(image.tobytes(encoder_name='raw')))
-        frame_len = len(frames[0])
-        row_len = images[0].size[0]//8
+        self.add_packed_raster_data(*[binary_frame(image) for image in images])
+
+    def add_packed_raster_data(self, frame, second_frame=None):
+        """
+        Add image data which is already packed to the instructions.
+        The frames consist of the raster lines in the order of transmission,
+        :py:meth:`get_pixel_width`/8 bytes each, as produced by
+        :py:func:`brother_ql.image_trafos.binary_frame` or
+        :py:func:`brother_ql.image_trafos.threshold_frame`.
+
+        :param bytes frame: The packed image
+        :param bytes second_frame: The packed second color layer (red layer for the QL-800 series)
+        """
+        row_len = self.get_pixel_width()//8
+        if len(frame) % row_len:
+            fmt = 'Wrong frame length: {}, expected a multiple of {}'
+            raise BrotherQLRasterError(fmt.format(len(frame), row_len))
+        frames = [frame]
+        if second_frame:
+            if len(frame) != len(second_frame):
+                fmt = "First and second frame don't have the same length: {} vs {}."
+                raise BrotherQLRasterError(fmt.format(len(frame), len(second_frame)))
+            frames.append(second_frame)
+        self._buffer += self._encode_frames(frames, row_len)
+
+    def add_instructions(self, instructions):
+        """
+        Add instructions which were serialized before (e.g. taken from a cache).
+        They are handed to the sink (if any) right away.
+
+        :param bytes instructions: The instructions
+        """
+        self._buffer += instructions
+        self.flush()
+
+    def add_raster_instructions(self, instructions):
+        """
+        Add raster line instructions that were already encoded, e.g. by
+        :py:meth:`add_raster_data` of another instance in a worker process.
+
+        :param bytes instructions: The encoded raster line instructions
+        """
+        self._buffer += instructions
+
+    def _raster_header(self, color, num_colors, translen):
+        """
+        Returns the opcode and length bytes preceding a single raster line.
+
+        :param int color: The index of the color layer (0: black, 1: red)
+        :param int num_colors: The number of color layers in the image (1 or 2)
+        :param int translen: Number of bytes to be transmitted for the line
+        """
+        if self.model.startswith('PT'):
+            return b'\x47' + bytes([translen%256, translen//256])
+        if num_colors > 1:
+            opcode = b'\x77\x01' if color == 0 else b'\x77\x02'
+        else:
+            opcode = b'\x67\x00'
+        return opcode + bytes([translen])
+
+    def _encode_frames(self, frames, row_len):
+        """
+        Encodes complete frames (one per color layer) into a block of
+        raster line instructions.
+
+        Uncompressed lines all share the same header, so the whole block
+        is assembled by Pillow as an 8-bit image whose rows are the raster
+        line instructions: the header bytes are filled in as constant
+        columns and each frame is pasted next to its header. No Python
+        level work is done per raster line.
+
+        :param list frames: Packed 1-bit frames (bytes), one per color layer.
+        :param int row_len: Number of bytes per raster line.
+        :returns: The raster line instructions of all lines.
+        :rtype: bytes
+        """
+        num_rows = len(frames[0]) // row_len
+        blank_rows = None
+        if self._zero_raster and num_rows:
+            blank_rows = self._blank_rows(frames, row_len, num_rows)
+        if self._compression:
+            return self._encode_compressed_rows(frames, row_len, num_rows, blank_rows)
+        if num_rows == 0:
+            return b''
+        headers = [self._raster_header(i, len(frames), row_len) for i in range(len(frames))]
+        stride = sum(len(header) + row_len for header in headers)
+        block = Image.new('L', (stride, num_rows))
+        x = 0
+        for header, frame in zip(headers, frames):
+            for byte in bytearray(header):
+                block.paste(byte, (x, 0, x+1, num_rows))
+                x += 1
+            block.paste(Image.frombytes('L', (row_len, num_rows), frame), (x, 0))
+            x += row_len
+        block = block.tobytes()
+        if blank_rows is None:
+            return block
+        # replace each run of blank lines with as many zero raster instructions
+        parts = []
+        view = memoryview(block)
         start = 0
-        file_str = BytesIO()
-        while start + row_len <= frame_len:
-            for i, frame in enumerate(frames):
-                row = frame[start:start+row_len]
-                if self._compression:
-                    row = packbits.encode(row)
+        for run in re.finditer(b'\x00+', blank_rows):
+            parts.append(view[start*stride:run.start()*stride])
+            parts.append(b'\x5A' * (run.end() - run.start()))
+            start = run.end()
+        parts.append(view[start*stride:])
+        return b''.join(parts)
+
+    def _blank_rows(self, frames, row_len, num_rows):
+        """
+        Detects the blank raster lines of all frames at once.
+
+        :returns: One byte per raster line, zero if and only if the line
+                  is blank in all color layers.
+        :rtype: bytes
+        """
+        ink = None
+        for frame in frames:
+            layer = Image.frombytes('L', (row_len, num_rows), frame).point(_NONZERO_LUT)
+            ink = layer if ink is None else ImageChops.lighter(ink, layer)
+        if row_len < 2*255:
+            # Averaging a line of 0/255 values: a single non-zero byte
+            # contributes 255/row_len >= 0.5 and thus survives the rounding.
+            return bytes(ink.resize((1, num_rows), Image.BOX).tobytes())
+        data = ink.tobytes()
+        blank = bytes(row_len)
+        return bytes(0 if data[i:i+row_len] == blank else 1 for i in range(0, len(data), row_len))
+
+    def _encode_compressed_rows(self, frames, row_len, num_rows, blank_rows=None):
+        """
+        Encodes the frames line by line with packbits compression.
+        The headers depend on the compressed line length and are memoized.
+        Identical lines are only compressed once per job.
+        """
+        encoder = self._row_encoders.get(row_len)
+        if encoder is None:
+            encoder = self._row_encoders[row_len] = PackBitsRowEncoder(row_len)
+        headers = [{} for frame in frames]
+        views = [memoryview(frame) for frame in frames]
+        parts = []
+        for index, start in enumerate(range(0, num_rows * row_len, row_len)):
+            if blank_rows is not None and not blank_rows[index]:
+                parts.append(b'\x5A')
+                continue
+            for i, view in enumerate(views):
+                row = encoder.encode(view[start:start+row_len])
                 translen = len(row) # number of bytes to be transmitted
-                if self.model.startswith('PT'):
-                    file_str.write(b'\x47')
-                    file_str.write(bytes([translen%256, translen//256]))
-                else:
-                    if second_image:
-                        file_str.write(b'\x77\x01' if i == 0 else b'\x77\x02')
-                    else:
-                        file_str.write(b'\x67\x00')
-                    file_str.write(bytes([translen]))
-                file_str.write(row)
-            start += row_len
-        self.data += file_str.getvalue()
+                header = headers[i].get(translen)
+                if header is None:
+                    header = headers[i][translen] = self._raster_header(i, len(frames), translen)
+                parts.append(header)
+                parts.append(row)
+        return b''.join(parts)
+
+    def add_job_profile(self, profile, rnumber):
+        """
+        Add the pre-serialized page header of a :py:class:`JobProfile`.
+        Equivalent to repeating the instructions recorded in the profile,
+        with the number of raster lines and the page number patched in.
+
+        The warnings recorded in the profile are issued again (raising the
+        first one as exception if `exception_on_warning` is set, after the
+        page header was added).
+
+        :param JobProfile profile: The compiled page header
+        :param int rnumber: The number of raster lines of the page
+        """
+        self._buffer += profile.prefix
+        self._buffer += struct.pack('<LBB', rnumber, 0 if self.page_number == 0 else 1, 0)
+        self._buffer += profile.suffix
+        for name, value in profile.state:
+            setattr(self, name, value)
+        for problem, kind in profile.warnings:
+            self._warn(problem, kind)
 
     def add_print(self, last_page=True):
         if last_page:
-            self.data += b'\x1A' # 0x1A = ^Z = SUB; here: EOF = End of File
+            self._buffer += b'\x1A' # 0x1A = ^Z = SUB; here: EOF = End of File
         else:
-            self.data += b'\x0C' # 0x0C = FF  = Form Feed
+            self._buffer += b'\x0C' # 0x0C = FF  = Form Feed
+        self.flush()
+
+class JobProfile(object):
+    """
+    The pre-serialized instructions preceding the raster lines of a page.
+
+    All pages of a job share the same page header except for the number of
+    raster lines and the page number in the media/quality instruction. The
+    profile is compiled once by recording the instructions added by
+    `add_header` on a scratch :py:class:`BrotherQLRaster` instance and can
+    then be added to every page with :py:meth:`BrotherQLRaster.add_job_profile`.
+
+    :param str model: The printer model.
+    :param callable add_header: A function adding the page header to the
+        BrotherQLRaster instance passed to it. It has to contain exactly
+        one media/quality instruction (:py:meth:`BrotherQLRaster.add_media_and_quality`).
+        Warnings issued by the instance (e.g. for unsupported instructions) are
+        recorded and issued again whenever the profile is added.
+    """
+
+    #: The attributes of the raster instance set while adding the page header
+    STATE_ATTRIBUTES = ('_mtype', '_mwidth', '_mlength', '_pquality', 'dpi_600', 'cut_at_end',
+                        'two_color_printing', '_compression', '_zero_raster')
+
+    def __init__(self, model, add_header):
+        qlr = BrotherQLRaster(model)
+        #: The warnings issued while adding the page header: (problem, kind)
+        self.warnings = []
+        qlr._warn = lambda problem, kind=BrotherQLRasterError: self.warnings.append((problem, kind))
+        add_header(qlr)
+        header = qlr.pop_data()
+        pos = header.find(b'\x1B\x69\x7A') # ESC i z
+        if pos < 0:
+            raise BrotherQLRasterError("The page header doesn't contain a media/quality instruction.")
+        pos += 3 + 4 # opcode, flags and media bytes
+        #: The instructions before the number of raster lines
+        self.prefix = header[:pos]
+        #: The instructions after the page number
+        self.suffix = header[pos+6:]
+        #: The attribute values to be set on the raster instance
+        self.state = tuple((name, getattr(qlr, name, None)) for name in self.STATE_ATTRIBUTES)
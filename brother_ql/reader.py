@@ -4,12 +4,16 @@ import struct
 import io
 import logging
 import sys
+from collections import namedtuple
 
+from attr import attrs, attrib
 from PIL import Image
 from PIL.ImageOps import colorize
 
 from builtins import bytes
 
+from .compression import packbits_decode
+
 logger = logging.getLogger(__name__)
 
 OPCODES = {
@@ -116,6 +120,143 @@ def hex_format(data):
     except ValueError: # Py2
         return ' '.join('{:02X}'.format(ord(byte)) for byte in data)
 
+#: The length of the longest opcode
+_MAX_OPCODE_LENGTH = max(len(opcode) for opcode in OPCODES)
+
+#: The instructions whose length is given by the bytes following the opcode
+_RASTER_NAMES = ('raster QL', '2-color raster QL', 'raster P-touch')
+
+#: The opcodes by their first byte (longest first) as tuples
+#: (opcode, name, length), the length being None for raster instructions
+_DISPATCH = [[] for _ in range(256)]
+for _opcode, (_name, _following, _) in OPCODES.items():
+    _length = None if _name in _RASTER_NAMES else len(_opcode) + max(_following, 0)
+    _DISPATCH[bytearray(_opcode)[0]].append((_opcode, _name, _length))
+_DISPATCH = [tuple(sorted(entries, key=lambda entry: -len(entry[0]))) for entries in _DISPATCH]
+del _opcode, _name, _following, _length
+
+#: The single byte opcodes by their value
+_SINGLE_BYTE_OPCODES = dict((bytearray(opcode)[0], opcode) for opcode in OPCODES if len(opcode) == 1)
+
+#: The opcodes ending a page
+_PRINT_OPCODES = frozenset(opcode for opcode, definition in OPCODES.items() if definition[0] == 'print')
+
+def _instruction_at(data, offset, end):
+    """
+    Identifies the instruction at `offset` using the first byte dispatch table.
+
+    :returns: A tuple (opcode, length). The opcode is None if unknown, the
+              length is None if data ends before the instruction is complete.
+    """
+    for opcode, name, length in _DISPATCH[data[offset]]:
+        size = len(opcode)
+        if size == 1 or data[offset:offset+size] == opcode:
+            break
+    else:
+        header = bytes(data[offset:offset+_MAX_OPCODE_LENGTH])
+        if len(header) < _MAX_OPCODE_LENGTH and any(opcode.startswith(header) for opcode in OPCODES.keys()):
+            return None, None
+        return None, 1
+    if length is None:
+        if offset + 2 >= end:
+            return opcode, None
+        if name == 'raster P-touch':
+            length = 3 + data[offset+1] + data[offset+2]*256
+        else:
+            length = 3 + data[offset+2]
+    if offset + length > end:
+        return opcode, None
+    return opcode, length
+
+def parse_instructions(data, offset=0, raise_exception=False, partial=False):
+    """
+    Parses instructions in a single pass without copying them.
+    Works on any buffer (bytes, bytearray, memoryview, mmap).
+
+    Logs warnings for unknown opcodes and skips a byte or raises an exception
+    instead, if raise_exception is set to True.
+
+    :param int offset: The offset to start parsing at.
+    :param bool partial: If True, parsing stops before an incomplete last
+                         instruction (to be resumed once the rest of it arrived).
+                         Otherwise the rest of the data is yielded as the last
+                         instruction (if its opcode is complete at least).
+    :returns: A generator of tuples (opcode, offset, length).
+    """
+    end = len(data)
+    while offset < end:
+        byte = data[offset]
+        # fast path for the most frequent instructions
+        if byte == 0x67 or byte == 0x77:
+            if offset + 2 < end and offset + 3 + data[offset+2] <= end:
+                length = 3 + data[offset+2]
+                yield _SINGLE_BYTE_OPCODES[byte], offset, length
+                offset += length
+                continue
+        elif byte == 0x00 or byte == 0x5A:
+            yield _SINGLE_BYTE_OPCODES[byte], offset, 1
+            offset += 1
+            continue
+        opcode, length = _instruction_at(data, offset, end)
+        if length is None:
+            if partial:
+                return
+            if opcode is not None:
+                yield opcode, offset, end - offset
+                return
+        if opcode is None:
+            msg = 'unknown opcode starting with {}...)'.format(hex_format(data[offset:offset+4]))
+            if raise_exception:
+                raise ValueError(msg)
+            logger.warning(msg)
+            offset += 1
+            continue
+        yield opcode, offset, length
+        offset += length
+
+def instruction_length(data, offset=0):
+    """
+    The length of the instruction at the start of data (or at `offset`).
+    Works on any buffer (bytes, bytearray, memoryview, mmap) without copying it.
+
+    :returns: The length in bytes or None if data ends before the
+              instruction is complete (or even before its opcode is).
+    :raises ValueError: if data doesn't start with a known opcode.
+    """
+    if offset >= len(data):
+        return None
+    opcode, length = _instruction_at(data, offset, len(data))
+    if opcode is None and length is not None:
+        raise ValueError('unknown opcode starting with {}...)'.format(hex_format(data[offset:offset+4])))
+    return length
+
+def page_boundaries(data):
+    """
+    Scans instructions for the ends of the pages (the print commands).
+    Works on any buffer (bytes, bytearray, memoryview, mmap) without copying it.
+
+    :returns: A generator of the offsets following the print commands.
+    """
+    for opcode, offset, length in parse_instructions(data, partial=True):
+        if opcode in _PRINT_OPCODES:
+            yield offset + length
+
+def split_pages(data):
+    """
+    Splits instructions into pages without copying them.
+
+    :param data: The instructions (bytes, bytearray, memoryview or mmap).
+    :returns: A generator of memoryviews of the pages. Instructions following
+              the last print command are yielded as a last page.
+    """
+    view = memoryview(data)
+    start = 0
+    for end in page_boundaries(data):
+        yield view[start:end]
+        start = end
+    if start < len(view):
+        yield view[start:]
+
 def chunker(data, raise_exception=False):
     """
     Breaks data stream (bytes) into a list of bytes objects containing single instructions each.
@@ -124,91 +265,134 @@ def chunker(data, raise_exception=False):
 
     returns: list of bytes objects
     """
-    instructions = []
-    data = bytes(data)
-    while True:
-        if len(data) == 0: break
-        try:
-            opcode = match_opcode(data)
-        except:
-            msg = 'unknown opcode starting with {}...)'.format(hex_format(data[0:4]))
-            if raise_exception:
-                raise ValueError(msg)
-            else:
-                logger.warning(msg)
-                data = data[1:]
-                continue
-        opcode_def = OPCODES[opcode]
-        num_bytes = len(opcode)
-        if opcode_def[1] > 0: num_bytes += opcode_def[1]
-        elif opcode_def[0] in ('raster QL', '2-color raster QL'):
-            num_bytes += data[2] + 2
-        elif opcode_def[0] in ('raster P-touch',):
-            num_bytes += data[1] + data[2]*256 + 2
-        #payload = data[len(opcode):num_bytes]
-        instructions.append(data[:num_bytes])
-        yield instructions[-1]
-        data = data[num_bytes:]
-    #return instructions
+    for opcode, offset, length in parse_instructions(data, raise_exception=raise_exception):
+        yield bytes(data[offset:offset+length])
 
 def match_opcode(data):
-    matching_opcodes = [opcode for opcode in OPCODES.keys() if data.startswith(opcode)]
+    matching_opcodes = [opcode for opcode, _, _ in _DISPATCH[data[0]] if data.startswith(opcode)] if data else []
     assert len(matching_opcodes) == 1
     return matching_opcodes[0]
 
-def interpret_response(data):
-    data = bytes(data)
-    if len(data) < 32:
-        raise NameError('Insufficient amount of data received', hex_format(data))
-    if not data.startswith(b'\x80\x20\x42'):
-        raise NameError("Printer response doesn't start with the usual header (80:20:42)", hex_format(data))
-    for i, byte_name in enumerate(RESP_BYTE_NAMES):
-        logger.debug('Byte %2d %24s %02X', i, byte_name+':', data[i])
-    errors = []
-    error_info_1 = data[8]
-    error_info_2 = data[9]
-    for error_bit in RESP_ERROR_INFORMATION_1_DEF:
-        if error_info_1 & (1 << error_bit):
-            logger.error('Error: ' + RESP_ERROR_INFORMATION_1_DEF[error_bit])
-            errors.append(RESP_ERROR_INFORMATION_1_DEF[error_bit])
-    for error_bit in RESP_ERROR_INFORMATION_2_DEF:
-        if error_info_2 & (1 << error_bit):
-            logger.error('Error: ' + RESP_ERROR_INFORMATION_2_DEF[error_bit])
-            errors.append(RESP_ERROR_INFORMATION_2_DEF[error_bit])
-
-    media_width  = data[10]
-    media_length = data[17]
-
-    media_type = data[11]
-    if media_type in RESP_MEDIA_TYPES:
-        media_type = RESP_MEDIA_TYPES[media_type]
-        logger.debug("Media type: %s", media_type)
-    else:
-        logger.error("Unknown media type %02X", media_type)
+@attrs(slots=True)
+class Instruction(object):
+    """
+    An instruction found by the :py:class:`BrotherQLReader`.
 
-    status_type = data[18]
-    if status_type in RESP_STATUS_TYPES:
-        status_type = RESP_STATUS_TYPES[status_type]
-        logger.debug("Status type: %s", status_type)
-    else:
-        logger.error("Unknown status type %02X", status_type)
+    The human readable renderings (:py:meth:`hex`, :py:meth:`to_dict` and
+    ``str()``) are only created on demand.
+    """
+    #: The offset of the instruction in the instructions analysed
+    offset = attrib(type=int)
+    #: The opcode of the instruction (see :py:data:`OPCODES`)
+    opcode = attrib(type=bytes)
+    #: The complete instruction, including the opcode
+    data = attrib(type=bytes)
 
-    phase_type = data[19]
-    if phase_type in RESP_PHASE_TYPES:
-        phase_type = RESP_PHASE_TYPES[phase_type]
-        logger.debug("Phase type: %s", phase_type)
-    else:
-        logger.error("Unknown phase type %02X", phase_type)
+    @property
+    def name(self):
+        return OPCODES[self.opcode][0]
+
+    @property
+    def payload(self):
+        """ A memoryview of the instruction without the opcode """
+        return memoryview(self.data)[len(self.opcode):]
+
+    def hex(self):
+        """ The payload as hex dump """
+        return hex_format(self.payload)
+
+    def to_dict(self):
+        return {
+          'offset': self.offset,
+          'name': self.name,
+          'opcode': hex_format(self.opcode),
+          'length': len(self.data),
+          'payload': self.hex(),
+        }
+
+    def __str__(self):
+        return " {} ({}) --> found! (payload: {})".format(self.name, hex_format(self.opcode), self.hex())
 
-    response = {
-      'status_type': status_type,
-      'phase_type': phase_type,
-      'media_type': media_type,
-      'media_width': media_width,
-      'media_length': media_length,
-      'errors': errors,
-    }
-    return response
+def _error_names(definitions):
+    # the names of the errors flagged, for every value of an error information byte
+    return [tuple(definitions[bit] for bit in sorted(definitions) if value & (1 << bit)) for value in range(256)]
+
+_ERROR_NAMES_1 = _error_names(RESP_ERROR_INFORMATION_1_DEF)
+_ERROR_NAMES_2 = _error_names(RESP_ERROR_INFORMATION_2_DEF)
+
+#: The fields of a status response (see RESP_BYTE_NAMES), the fixed and reserved bytes are skipped
+_STATUS_STRUCT = struct.Struct('>3s5xBBBB3xBxBBBHB9x')
+
+class PrinterStatus(namedtuple('PrinterStatus', 'status_type phase_type media_type media_width media_length errors mode phase_number notification')):
+    """
+    A status response of the printer.
+
+    The types are given by their names (or as integers if unknown),
+    `errors` is a tuple of the names of the errors reported.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Decodes a status response (32 bytes).
+
+        :raises ValueError: if data is too short or doesn't start with the status header.
+        """
+        try:
+            (header, error_info_1, error_info_2, media_width, media_type, mode, media_length,
+             status_type, phase_type, phase_number, notification) = _STATUS_STRUCT.unpack_from(data)
+        except struct.error:
+            raise ValueError('Insufficient amount of data received', hex_format(data))
+        if header != b'\x80\x20\x42':
+            raise ValueError("Printer response doesn't start with the usual header (80:20:42)", hex_format(data))
+        if media_type in RESP_MEDIA_TYPES:
+            media_type = RESP_MEDIA_TYPES[media_type]
+        else:
+            logger.error("Unknown media type %02X", media_type)
+        if status_type in RESP_STATUS_TYPES:
+            status_type = RESP_STATUS_TYPES[status_type]
+        else:
+            logger.error("Unknown status type %02X", status_type)
+        if phase_type in RESP_PHASE_TYPES:
+            phase_type = RESP_PHASE_TYPES[phase_type]
+        else:
+            logger.error("Unknown phase type %02X", phase_type)
+        errors = _ERROR_NAMES_1[error_info_1] + _ERROR_NAMES_2[error_info_2]
+        return cls(status_type, phase_type, media_type, media_width, media_length, errors, mode, phase_number, notification)
+
+    def to_dict(self):
+        """ The status as dictionary, as returned by :py:func:`interpret_response` """
+        return {
+          'status_type': self.status_type,
+          'phase_type': self.phase_type,
+          'media_type': self.media_type,
+          'media_width': self.media_width,
+          'media_length': self.media_length,
+          'errors': list(self.errors),
+        }
+
+def interpret_response(data):
+    """
+    Decodes a status response of the printer into a dictionary.
+    See :py:class:`PrinterStatus` for a faster way to do this.
+
+    :raises NameError: if data is too short or doesn't start with the status header.
+    """
+    try:
+        status = PrinterStatus.decode(data)
+    except ValueError as e:
+        raise NameError(*e.args)
+    if logger.isEnabledFor(logging.DEBUG):
+        data = bytes(data)
+        for i, byte_name in enumerate(RESP_BYTE_NAMES):
+            logger.debug('Byte %2d %24s %02X', i, byte_name+':', data[i])
+        logger.debug("Media type: %s", status.media_type)
+        logger.debug("Status type: %s", status.status_type)
+        logger.debug("Phase type: %s", status.phase_type)
+    for error in status.errors:
+        logger.error('Error: ' + error)
+    return status.to_dict()
 
 
 def merge_specific_instructions(chunks, join_preamble=True, join_raster=True):
@@ -235,119 +419,203 @@ def merge_specific_instructions(chunks, join_preamble=True, join_raster=True):
     return new_instructions
 
 class BrotherQLReader(object):
+    """
+    Interprets instructions for the printers and renders the pages they print.
+
+    The instructions are processed incrementally: :py:meth:`analyse` reads
+    them in chunks from a file or a socket and :py:meth:`feed` takes data
+    obtained otherwise (e.g. a live tap of the printer traffic). The parser
+    state is kept across chunk boundaries and every page is handed to the
+    page callback as soon as its print command arrives. Only the rows of
+    the current page are kept, so the memory needed doesn't grow with the
+    size of the instructions.
+
+    :param brother_file: A file name, a file-like object or a socket.
+    :param page_callback: Called with the image and the statistics (a dictionary) of
+                          every page printed. By default, the images are saved as files
+                          named according to `filename_fmt`.
+    :param bool render: If False, the rows of the pages are not kept and no images are
+                        created (the page callback gets None), only statistics.
+    :param instruction_callback: Called with an :py:class:`Instruction` for every instruction
+                                 found. The instructions are also logged (at the level DEBUG).
+    """
     DEFAULT_FILENAME_FMT = 'label{counter:04d}.png'
+    DEFAULT_CHUNK_SIZE = 64*1024
 
-    def __init__(self, brother_file):
+    def __init__(self, brother_file=None, page_callback=None, render=True, instruction_callback=None):
         if type(brother_file) in (str,):
             brother_file = io.open(brother_file, 'rb')
         self.brother_file = brother_file
+        self.page_callback = page_callback or self._report_page
+        self.render = render
+        self.instruction_callback = instruction_callback
         self.mwidth, self.mheight = None, None
+        self.mlength = None
         self.raster_no = None
         self.black_rows = []
         self.red_rows = []
         self.compression = False
+        self.row_length = 90
         self.page_counter = 1
         self.two_color_printing = False
         self.cut_at_end = False
         self.high_resolution_printing = False
         self.filename_fmt = self.DEFAULT_FILENAME_FMT
+        self._buffer = bytearray()
+        #: The offset of the buffer in the instructions analysed
+        self._offset = 0
+        self._reset_page()
+
+    def _reset_page(self):
+        self.black_rows = []
+        self.red_rows = []
+        self._black_row_count = 0
+        self._red_row_count = 0
+        self._zero_row_count = 0
+        self._page_bytes = 0
 
-    def analyse(self):
-        instructions = self.brother_file.read()
-        for instruction in chunker(instructions):
-            for opcode in OPCODES.keys():
-                if instruction.startswith(opcode):
-                    opcode_def = OPCODES[opcode]
-                    if opcode_def[0] == 'init':
-                        self.mwidth, self.mheight = None, None
-                        self.raster_no = None
-                        self.black_rows = []
-                        self.red_rows = []
-                    payload = instruction[len(opcode):]
-                    logger.info(" {} ({}) --> found! (payload: {})".format(opcode_def[0], hex_format(opcode), hex_format(payload)))
-                    if opcode_def[0] == 'compression':
-                        self.compression = payload[0] == 0x02
-                    if opcode_def[0] == 'zero raster':
-                        self.black_rows.append(bytes())
-                        if self.two_color_printing:
-                            self.red_rows.append(bytes())
-                    if opcode_def[0] in ('raster QL', '2-color raster QL', 'raster P-touch'):
-                        rpl = bytes(payload[2:]) # raster payload
-                        if self.compression:
-                            row = bytes()
-                            index = 0
-                            while True:
-                                num = rpl[index]
-                                if num & 0x80:
-                                    num = num - 0x100
-                                if num < 0:
-                                    num = -num + 1
-                                    row += bytes([rpl[index+1]] * num)
-                                    index += 2
-                                else:
-                                    num = num + 1
-                                    row += rpl[index+1:index+1+num]
-                                    index += 1 + num
-                                if index >= len(rpl): break
-                        else:
-                            row = rpl
-                        if opcode_def[0] in ('raster QL', 'raster P-touch'):
-                            self.black_rows.append(row)
-                        else: # 2-color
-                            if   payload[0] == 0x01:
-                                self.black_rows.append(row)
-                            elif payload[0] == 0x02:
-                                self.red_rows.append(row)
-                            else:
-                                raise NotImplementedError("color: 0x%x" % payload[0])
-                    if opcode_def[0] == 'expanded':
-                        self.two_color_printing = bool(payload[0] & (1 << 0))
-                        self.cut_at_end = bool(payload[0] & (1 << 3))
-                        self.high_resolution_printing = bool(payload[0] & (1 << 6))
-                    if opcode_def[0] == 'media/quality':
-                        self.raster_no = struct.unpack('<L', payload[4:8])[0]
-                        self.mwidth = instruction[len(opcode) + 2]
-                        self.mlength = instruction[len(opcode) + 3]*256
-                        fmt = " media width: {} mm, media length: {} mm, raster no: {} rows"
-                        logger.info(fmt.format(self.mwidth, self.mlength, self.raster_no))
-                    if opcode_def[0] == 'print':
-                        logger.info("Len of black rows: %d", len(self.black_rows))
-                        logger.info("Len of red   rows: %d", len(self.red_rows))
-                        def get_im(rows):
-                            if not len(rows): return None
-                            width_dots  = max(len(row) for row in rows)
-                            height_dots = len(rows)
-                            size = (width_dots*8, height_dots)
-                            expanded_rows = []
-                            for row in rows:
-                                if len(row) == 0:
-                                    expanded_rows.append(b'\x00'*width_dots)
-                                else:
-                                    expanded_rows.append(row)
-                            data = bytes(b''.join(expanded_rows))
-                            data = bytes([2**8 + ~byte for byte in data]) # invert b/w
-                            im = Image.frombytes("1", size, data, decoder_name='raw')
-                            return im
-                        if not self.two_color_printing:
-                            im_black = get_im(self.black_rows)
-                            im = im_black
-                        else:
-                            im_black, im_red = (get_im(rows) for rows in (self.black_rows, self.red_rows))
-                            im_black = im_black.convert("RGBA")
-                            im_red = im_red.convert("L")
-                            im_red = colorize(im_red, (255, 0, 0), (255, 255, 255))
-                            im_red = im_red.convert("RGBA")
-                            pixdata_black = im_black.load()
-                            width, height = im_black.size
-                            for y in range(height):
-                                for x in range(width):
-                                    # replace "white" with "transparent"
-                                    if pixdata_black[x, y] == (255, 255, 255, 255):
-                                        pixdata_black[x, y] = (255, 255, 255, 0)
-                            im_red.paste(im_black, (0, 0), im_black)
-                            im = im_red
-                        im = im.transpose(Image.FLIP_LEFT_RIGHT)
-                        img_name = self.filename_fmt.format(counter=self.page_counter)
-                        im.save(img_name)
-                        print('Page saved as {}'.format(img_name))
-                        self.page_counter += 1
+    def analyse(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Reads and processes all instructions from the file (or socket), `chunk_size` bytes at a time """
+        read = getattr(self.brother_file, 'read', None) or self.brother_file.recv
+        while True:
+            data = read(chunk_size)
+            if not data:
+                break
+            self.feed(data)
+        self.finish()
+
+    def feed(self, data):
+        """ Processes a chunk of instructions, an incomplete last instruction is kept for the next chunk """
+        self._buffer += data
+        end = 0
+        for opcode, offset, length in parse_instructions(self._buffer, partial=True):
+            end = offset + length
+            self._process(opcode, bytes(self._buffer[offset:end]), self._offset + offset)
+        del self._buffer[:end]
+        self._offset += end
+
+    def finish(self):
+        """ Processes what is left over at the end of the instructions (an incomplete instruction) """
+        for opcode, offset, length in parse_instructions(self._buffer):
+            self._process(opcode, bytes(self._buffer[offset:offset+length]), self._offset + offset)
+        self._offset += len(self._buffer)
+        del self._buffer[:]
+
+    def save_page(self, im, statistics):
+        """
+        Saves the image of a page as a file named according to `filename_fmt`.
+
+        :returns: The file name, None if there is no image.
+        """
+        if im is None:
+            return None
+        img_name = self.filename_fmt.format(counter=statistics['page'])
+        im.save(img_name)
+        return img_name
+
+    def _report_page(self, im, statistics):
+        img_name = self.save_page(im, statistics)
+        if img_name:
+            print('Page saved as {}'.format(img_name))
+
+    def _process(self, opcode, instruction, offset):
+        opcode_def = OPCODES[opcode]
+        self._page_bytes += len(instruction)
+        # the record (and its hex dump) is only created if anybody is interested
+        if self.instruction_callback is not None or logger.isEnabledFor(logging.INFO):
+            record = Instruction(offset, opcode, instruction)
+            logger.info('%s', record)
+            if self.instruction_callback is not None:
+                self.instruction_callback(record)
+        if opcode_def[0] == 'init':
+            self.mwidth, self.mheight = None, None
+            self.raster_no = None
+            self._reset_page()
+        payload = instruction[len(opcode):]
+        if opcode_def[0] == 'compression':
+            self.compression = payload[0] == 0x02
+        if opcode_def[0] == 'zero raster':
+            self._zero_row_count += 1
+            self._black_row_count += 1
+            if self.render:
+                self.black_rows.append(bytes())
+            if self.two_color_printing:
+                self._red_row_count += 1
+                if self.render:
+                    self.red_rows.append(bytes())
+        if opcode_def[0] in ('raster QL', '2-color raster QL', 'raster P-touch'):
+            rpl = bytes(payload[2:]) # raster payload
+            if self.compression:
+                row = packbits_decode(rpl)
+            else:
+                row = rpl
+            if row: self.row_length = len(row)
+            if opcode_def[0] in ('raster QL', 'raster P-touch'):
+                rows = self.black_rows
+                self._black_row_count += 1
+            else: # 2-color
+                if   payload[0] == 0x01:
+                    rows = self.black_rows
+                    self._black_row_count += 1
+                elif payload[0] == 0x02:
+                    rows = self.red_rows
+                    self._red_row_count += 1
+                else:
+                    raise NotImplementedError("color: 0x%x" % payload[0])
+            if self.render:
+                rows.append(row)
+        if opcode_def[0] == 'expanded':
+            self.two_color_printing = bool(payload[0] & (1 << 0))
+            self.cut_at_end = bool(payload[0] & (1 << 3))
+            self.high_resolution_printing = bool(payload[0] & (1 << 6))
+        if opcode_def[0] == 'media/quality':
+            self.raster_no = struct.unpack('<L', payload[4:8])[0]
+            self.mwidth = instruction[len(opcode) + 2]
+            self.mlength = instruction[len(opcode) + 3]*256
+            logger.info(" media width: %d mm, media length: %d mm, raster no: %d rows", self.mwidth, self.mlength, self.raster_no)
+        if opcode_def[0] == 'print':
+            logger.info("Len of black rows: %d", self._black_row_count)
+            logger.info("Len of red   rows: %d", self._red_row_count)
+            statistics = {
+              'page': self.page_counter,
+              'rows': max(self._black_row_count, self._red_row_count),
+              'black_rows': self._black_row_count,
+              'red_rows': self._red_row_count,
+              'zero_rows': self._zero_row_count,
+              'width': self.row_length * 8,
+              'bytes': self._page_bytes,
+              'media_width': self.mwidth,
+              'media_length': self.mlength,
+              'raster_no': self.raster_no,
+              'compression': self.compression,
+              'two_color_printing': self.two_color_printing,
+            }
+            im = self._render_page() if self.render else None
+            self._reset_page()
+            self.page_callback(im, statistics)
+            self.page_counter += 1
+
+    def _render_page(self):
+        def get_im(rows, rawmode='1;I'):
+            if not len(rows): return None
+            # all lines could be 'zero raster' lines, then use the last known line length
+            width_dots  = max(len(row) for row in rows) or self.row_length
+            height_dots = len(rows)
+            size = (width_dots*8, height_dots)
+            blank = bytes(width_dots)
+            data = b''.join(row or blank for row in rows)
+            # set bits are black: the raw mode '1;I' inverts them while decoding
+            return Image.frombytes("1", size, data, 'raw', rawmode)
+        if not self.two_color_printing:
+            im = get_im(self.black_rows)
+        else:
+            # black pixels (as set bits) are painted over the red layer
+            black_mask = get_im(self.black_rows, rawmode='1')
+            im_red = get_im(self.red_rows).convert("L")
+            im_red = colorize(im_red, (255, 0, 0), (255, 255, 255))
+            im_red = im_red.convert("RGBA")
+            im_red.paste((0, 0, 0, 255), (0, 0) + black_mask.size, black_mask)
+            im = im_red
+        if im is None:
+            return None
+        return im.transpose(Image.FLIP_LEFT_RIGHT)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+"""
+A print spooler for Brother QL printers
+
+The :py:class:`Spooler` keeps a queue of jobs for every printer and a
+worker thread per printer sending them one after the other. Jobs can be
+queued for a specific printer or for a group of identical printers, in
+which case the printers of the group take turns (round-robin).
+
+As :py:func:`brother_ql.backends.helpers.send` returns as soon as the
+printer reports 'Waiting to receive', the next job of a printer is sent
+the moment the printer is ready for it.
+
+:py:class:`SpoolerHTTPServer` exposes a spooler via a small HTTP API
+(used by the command ``brother_ql serve``):
+
+* ``POST /jobs?printer=<printer or group>&priority=<int>`` with the instructions as the request body
+* ``GET /jobs/<id>``
+* ``GET /printers``
+"""
+
+from __future__ import unicode_literals
+
+import heapq, itertools, json, logging, threading, time, uuid
+from collections import OrderedDict, deque
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError: # Py2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from brother_ql.backends.helpers import send
+from brother_ql.exceptions import BrotherQLSpoolerError, BrotherQLQueueFull
+
+logger = logging.getLogger(__name__)
+
+class Job(object):
+    """
+    A print job queued in the :py:class:`Spooler`.
+    """
+
+    def __init__(self, instructions, target, priority=0):
+        #: The unique identifier of the job
+        self.id = uuid.uuid4().hex
+        #: The instructions to be sent to the printer
+        self.instructions = instructions
+        self.size = len(instructions)
+        #: The printer or group the job was submitted for
+        self.target = target
+        #: Jobs with a higher priority are sent first
+        self.priority = priority
+        #: The printer the job was assigned to
+        self.printer = None
+        #: 'queued', 'sending', 'done' or 'error'
+        self.state = 'queued'
+        #: The status dictionary returned by :py:func:`brother_ql.backends.helpers.send`
+        self.result = None
+        #: A description of the error which occurred while sending
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+          'id': self.id,
+          'target': self.target,
+          'printer': self.printer,
+          'priority': self.priority,
+          'state': self.state,
+          'size': self.size,
+          'result': self.result,
+          'error': self.error,
+          'submitted': self.submitted,
+          'started': self.started,
+          'finished': self.finished,
+        }
+
+class _PrinterQueue(object):
+    """ The priority queue of a single printer and the worker thread processing it """
+
+    def __init__(self, spooler, printer_identifier, backend_identifier=None):
+        self.spooler = spooler
+        self.printer_identifier = printer_identifier
+        self.backend_identifier = backend_identifier
+        self.current = None
+        self.jobs_done = 0
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='spooler ' + printer_identifier)
+        self._thread.daemon = True
+
+    def __len__(self):
+        return len(self._heap)
+
+    def put(self, job):
+        with self._condition:
+            if len(self._heap) >= self.spooler.max_queue_size:
+                raise BrotherQLQueueFull('The queue of {} is full.'.format(self.printer_identifier))
+            job.printer = self.printer_identifier
+            # highest priority first, FIFO among jobs of the same priority
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job))
+            self._condition.notify()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _next_job(self):
+        with self._condition:
+            while not self._heap and not self._stopped:
+                self._condition.wait()
+            if self._stopped:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self.current = job
+            job.state = 'sending'
+            job.started = time.time()
+            try:
+                job.result = send(job.instructions, self.printer_identifier, self.backend_identifier,
+                                  blocking=True, timeout=self.spooler.timeout)
+                job.state = 'error' if job.result['outcome'] == 'error' else 'done'
+            except Exception as e:
+                logger.exception('Sending job %s to %s failed.', job.id, self.printer_identifier)
+                job.state = 'error'
+                job.error = str(e)
+            job.finished = time.time()
+            job.instructions = b''
+            self.current = None
+            self.jobs_done += 1
+            self.spooler._finished(job)
+
+    def to_dict(self):
+        return {
+          'printer': self.printer_identifier,
+          'backend': self.backend_identifier,
+          'queued': len(self._heap),
+          'current_job': self.current.id if self.current else None,
+          'jobs_done': self.jobs_done,
+        }
+
+class Spooler(object):
+    """
+    Queues print jobs per printer and sends them in the background.
+
+    :param int max_queue_size: The maximum number of jobs waiting for a printer.
+                               Submitting further jobs raises :py:exc:`BrotherQLQueueFull`.
+    :param float timeout: The time to wait for a printer to complete a job (in seconds).
+    :param int max_finished_jobs: The number of finished jobs to keep for status queries.
+    """
+
+    def __init__(self, max_queue_size=100, timeout=10., max_finished_jobs=1000):
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.max_finished_jobs = max_finished_jobs
+        self._queues = OrderedDict()
+        self._groups = OrderedDict()
+        self._round_robin = {}
+        self._jobs = {}
+        self._finished_jobs = deque()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def add_printer(self, printer_identifier, backend_identifier=None, group=None):
+        """
+        Adds a printer to be served by the spooler.
+
+        :param str group: The name of a group of identical printers to add the printer to.
+        """
+        with self._lock:
+            if printer_identifier in self._queues:
+                raise BrotherQLSpoolerError('Printer {} added twice.'.format(printer_identifier))
+            queue = _PrinterQueue(self, printer_identifier, backend_identifier)
+            self._queues[printer_identifier] = queue
+            if group is not None:
+                self._groups.setdefault(group, []).append(queue)
+                self._round_robin[group] = itertools.cycle(self._groups[group])
+            if self._running:
+                queue.start()
+
+    def start(self):
+        """ Starts the worker threads """
+        with self._lock:
+            self._running = True
+            for queue in self._queues.values():
+                queue.start()
+
+    def stop(self, timeout=None):
+        """ Stops the worker threads after their current job. Queued jobs are not sent. """
+        with self._lock:
+            self._running = False
+            queues = list(self._queues.values())
+        for queue in queues:
+            queue.stop()
+        for queue in queues:
+            queue.join(timeout)
+
+    def submit(self, instructions, target=None, priority=0):
+        """
+        Queues a job.
+
+        :param bytes instructions: The instructions to be sent.
+        :param str target: A printer identifier or group name. Can be omitted if there is a single printer.
+        :param int priority: Jobs with a higher priority are sent before the ones with a lower priority.
+        :returns: The :py:class:`Job` created.
+        """
+        with self._lock:
+            if target is None and len(self._queues) == 1:
+                target = next(iter(self._queues))
+            job = Job(instructions, target, priority)
+            if target in self._groups:
+                self._submit_to_group(job, target)
+            elif target in self._queues:
+                self._queues[target].put(job)
+            else:
+                raise BrotherQLSpoolerError('Unknown printer or group: {}'.format(target))
+            self._jobs[job.id] = job
+        return job
+
+    def _submit_to_group(self, job, group):
+        # round-robin, skipping the printers with a full queue
+        for _ in range(len(self._groups[group])):
+            queue = next(self._round_robin[group])
+            try:
+                queue.put(job)
+                return
+            except BrotherQLQueueFull:
+                continue
+        raise BrotherQLQueueFull('The queues of all printers of {} are full.'.format(group))
+
+    def _finished(self, job):
+        with self._lock:
+            self._finished_jobs.append(job.id)
+            while len(self._finished_jobs) > self.max_finished_jobs:
+                self._jobs.pop(self._finished_jobs.popleft(), None)
+
+    def get_job(self, job_id):
+        """ :returns: The job with the given id or None """
+        return self._jobs.get(job_id)
+
+    def printers(self):
+        """ :returns: A list of dictionaries describing the state of the printers """
+        with self._lock:
+            groups = {queue.printer_identifier: group for group, queues in self._groups.items() for queue in queues}
+            result = []
+            for printer_identifier, queue in self._queues.items():
+                info = queue.to_dict()
+                info['group'] = groups.get(printer_identifier)
+                result.append(info)
+            return result
+
+class _SpoolerRequestHandler(BaseHTTPRequestHandler):
+
+    def _respond(self, code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        spooler = self.server.spooler
+        if path == '/printers':
+            self._respond(200, spooler.printers())
+        elif path.startswith('/jobs/'):
+            job = spooler.get_job(path[len('/jobs/'):])
+            if job is None:
+                self._respond(404, {'error': 'Unknown job'})
+            else:
+                self._respond(200, job.to_dict())
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            self._respond(404, {'error': 'Not found'})
+            return
+        query = parse_qs(url.query)
+        try:
+            priority = int(query.get('priority', ['0'])[0])
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError as e:
+            self._respond(400, {'error': str(e)})
+            return
+        instructions = self.rfile.read(length)
+        if not instructions:
+            self._respond(400, {'error': 'No instructions received'})
+            return
+        try:
+            job = self.server.spooler.submit(instructions, query.get('printer', [None])[0], priority)
+        except BrotherQLQueueFull as e:
+            self._respond(429, {'error': str(e)})
+        except BrotherQLSpoolerError as e:
+            self._respond(404, {'error': str(e)})
+        else:
+            self._respond(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        logger.info('%s - ' + format, self.address_string(), *args)
+
+class SpoolerHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP API for a :py:class:`Spooler`, see the module documentation.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, spooler, host='127.0.0.1', port=8013):
+        self.spooler = spooler
+        HTTPServer.__init__(self, (host, port), _SpoolerRequestHandler)
@@ -0,0 +1,48 @@
+import random
+
+import packbits
+import pytest
+
+from brother_ql.compression import packbits_encode, packbits_decode, PackBitsRowEncoder
+
+def rows():
+    rnd = random.Random(0)
+    yield b''
+    yield b'\x00'
+    yield b'\x00' * 90
+    yield b'\xFF' * 300
+    yield bytes(range(256))
+    yield b'\x00\x01' * 100 + b'\x02' * 129 + b'\x03'
+    for _ in range(50):
+        row = bytearray()
+        while len(row) < 90:
+            if rnd.random() < 0.5:
+                row += bytes([rnd.randrange(256)]) * rnd.randrange(1, 200)
+            else:
+                row += bytes(rnd.randrange(256) for _ in range(rnd.randrange(1, 200)))
+        yield bytes(row)
+
+@pytest.mark.parametrize('row', list(rows()))
+def test_packbits_encode_matches_reference(row):
+    assert packbits_encode(row) == packbits.encode(row)
+
+@pytest.mark.parametrize('row', list(rows()))
+def test_packbits_roundtrip(row):
+    assert packbits_decode(packbits_encode(row)) == row
+    assert packbits_decode(packbits.encode(row)) == row
+
+def test_packbits_decode_longest_run():
+    # a header of 0x80 repeats the following byte 129 times
+    assert packbits_decode(b'\x80\xAA') == b'\xAA' * 129
+
+def test_row_encoder():
+    encoder = PackBitsRowEncoder(90, max_cache_size=2)
+    for row in rows():
+        row = row[:90].ljust(90, b'\x00')
+        expected = packbits.encode(row)
+        assert encoder.encode(row) == expected
+        assert encoder.encode(memoryview(row)) == expected
+        # writable buffers can't be memoized as they are
+        assert encoder.encode(bytearray(row)) == expected
+        assert encoder.encode(memoryview(bytearray(row))) == expected
+    assert len(encoder._cache) <= 2
@@ -0,0 +1,71 @@
+import io, os, sys
+
+import pytest
+from PIL import Image, ImageDraw, ImageOps
+
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.conversion import convert
+from brother_ql.reader import BrotherQLReader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks'))
+from raster_encoding import legacy_encode_frames, batched_encode_frames, label_image
+
+@pytest.mark.parametrize('model, two_color, compress', [
+    ('QL-1050', False, False),
+    ('QL-700', False, False),
+    ('QL-820NWB', True, False),
+    ('PT-P750W', False, False),
+    ('QL-1050', False, True),
+    ('QL-820NWB', True, True),
+])
+def test_batched_encoding_matches_legacy(model, two_color, compress):
+    qlr = BrotherQLRaster(model)
+    qlr._compression = compress
+    width = qlr.get_pixel_width()
+    images = [label_image(width, 300, seed=1)]
+    if two_color:
+        images.append(label_image(width, 300, seed=2))
+    frames = [bytes(im.transpose(Image.FLIP_LEFT_RIGHT).tobytes()) for im in images]
+    row_len = width//8
+    assert batched_encode_frames(qlr, frames, row_len) == legacy_encode_frames(qlr, frames, row_len)
+
+def label(width, height=120):
+    im = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(im)
+    draw.rectangle([10, 10, 99, 49], fill='black')
+    draw.rectangle([width - 30, 80, width - 21, height - 1], fill='black')
+    return im
+
+def black(im):
+    """ The bounding box size and the number of the black pixels of an image """
+    inverted = ImageOps.invert(im.convert('L'))
+    left, upper, right, lower = inverted.getbbox()
+    return (right - left, lower - upper), inverted.histogram()[255]
+
+def analyse(data):
+    pages = []
+    reader = BrotherQLReader(io.BytesIO(data), page_callback=lambda im, statistics: pages.append((im, statistics)))
+    reader.analyse()
+    return pages
+
+@pytest.mark.parametrize('model, label_name, width', [('QL-720NW', '62', 696), ('PT-P750W', 'pt24', 128)])
+@pytest.mark.parametrize('compress', [False, True])
+def test_convert_reader_roundtrip(model, label_name, width, compress):
+    images = [label(width), label(width, 200)]
+    qlr = BrotherQLRaster(model)
+    data = convert(qlr, images, label_name, compress=compress)
+    pages = analyse(data)
+    assert len(pages) == 2
+    for image, (im, statistics) in zip(images, pages):
+        assert statistics['rows'] == image.size[1]
+        assert statistics['compression'] == compress
+        assert black(im) == black(image)
+
+def test_convert_zero_raster():
+    images = [Image.new('RGB', (696, 100), 'white'), label(696)]
+    plain = convert(BrotherQLRaster('QL-820NWB'), images, '62')
+    zero = convert(BrotherQLRaster('QL-820NWB'), images, '62', zero_raster=True)
+    assert len(zero) < len(plain)
+    pages = analyse(zero)
+    assert pages[0][1]['zero_rows'] == 100
+    assert [black(im) for im, statistics in pages[1:]] == [black(im) for im, statistics in analyse(plain)[1:]]
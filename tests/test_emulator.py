@@ -0,0 +1,46 @@
+from PIL import Image, ImageDraw
+
+from brother_ql.raster import BrotherQLRaster
+from brother_ql.conversion import convert
+from brother_ql.backends.emulator import PrinterEmulator
+from brother_ql.backends.helpers import send
+from brother_ql.backends.session import PrintSession
+
+def job(pages=1, compress=False):
+    im = Image.new('RGB', (696, 100), 'white')
+    ImageDraw.Draw(im).rectangle([10, 10, 99, 49], fill='black')
+    return convert(BrotherQLRaster('QL-820NWB'), [im] * pages, '62', compress=compress)
+
+def test_send():
+    status = send(job(), 'emulator://QL-820NWB?speed=0')
+    assert status['outcome'] == 'printed'
+    assert status['did_print']
+    assert status['write_stats']['bytes_written'] == len(job())
+
+def test_send_chunks():
+    status = send(iter([job(), b'']), 'emulator://QL-820NWB?speed=0', blocking=False)
+    assert status['outcome'] == 'sent'
+
+def test_send_error():
+    status = send(job(), 'emulator://QL-820NWB?speed=0&error=Tape cutter jam')
+    assert status['outcome'] == 'error'
+    assert status['printer_state']['errors'] == ['Tape cutter jam']
+
+def test_emulator_pages():
+    emulator = PrinterEmulator('QL-820NWB', speed=0)
+    data = job(pages=3, compress=True)
+    # instructions split at arbitrary positions are processed once complete
+    for start in range(0, len(data), 100):
+        emulator.feed(data[start:start+100])
+    assert emulator.pages_printed == 3
+    assert emulator.rows_printed == 300
+    assert emulator.bytes_received == len(data)
+
+def test_session():
+    emulator = PrinterEmulator('QL-820NWB', speed=0)
+    with PrintSession(emulator, 'emulator', pool=False) as session:
+        for _ in range(3):
+            session.submit(job(pages=2))
+    assert [status['outcome'] for status in session.jobs] == ['printed'] * 3
+    assert session.labels_printed == 6
+    assert emulator.pages_printed == 6
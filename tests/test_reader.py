@@ -0,0 +1,109 @@
+import pytest
+
+from brother_ql.reader import parse_instructions, split_pages, page_boundaries, instruction_length, \
+                              PrinterStatus, interpret_response
+
+INIT = b'\x1B\x40'
+STATUS_REQUEST = b'\x1B\x69\x53'
+RASTER = b'\x67\x00\x03\xFF\x00\xFF'
+PT_RASTER = b'\x47\x02\x00\xFF\xFF'
+PRINT = b'\x0C'
+PRINT_LAST = b'\x1A'
+
+def job(pages=2):
+    data = b'\x00' * 10 + INIT
+    for page in range(pages):
+        data += RASTER * 3 + b'\x5A' + PT_RASTER
+        data += PRINT if page < pages - 1 else PRINT_LAST
+    return data
+
+def test_parse_instructions():
+    data = job(1)
+    instructions = list(parse_instructions(data))
+    assert [opcode for opcode, offset, length in instructions] == \
+        [b'\x00'] * 10 + [INIT] + [b'\x67'] * 3 + [b'\x5A', b'\x47', PRINT_LAST]
+    # the instructions cover the data without gaps
+    end = 0
+    for opcode, offset, length in instructions:
+        assert offset == end
+        end = offset + length
+    assert end == len(data)
+
+@pytest.mark.parametrize('buffer_type', [bytes, bytearray, memoryview])
+def test_parse_instructions_buffers(buffer_type):
+    assert list(parse_instructions(buffer_type(job()))) == list(parse_instructions(job()))
+
+def test_parse_instructions_partial():
+    data = job(1)
+    # cut off within the last raster line
+    cut = data.index(b'\x5A') - 2
+    instructions = list(parse_instructions(data[:cut], partial=True))
+    assert instructions[-1][1] + instructions[-1][2] == data.index(RASTER) + 2 * len(RASTER)
+    # without partial, the rest is yielded as the last instruction
+    assert list(parse_instructions(data[:cut]))[-1] == (b'\x67', data.index(RASTER) + 2 * len(RASTER), 4)
+
+def test_parse_instructions_unknown_opcode():
+    data = INIT + b'\xEE' + PRINT_LAST
+    assert [opcode for opcode, offset, length in parse_instructions(data)] == [INIT, PRINT_LAST]
+    with pytest.raises(ValueError):
+        list(parse_instructions(data, raise_exception=True))
+
+def test_instruction_length():
+    assert instruction_length(RASTER) == len(RASTER)
+    assert instruction_length(PT_RASTER) == len(PT_RASTER)
+    assert instruction_length(STATUS_REQUEST) == len(STATUS_REQUEST)
+    assert instruction_length(RASTER[:4]) is None
+    assert instruction_length(b'\x1B\x69') is None
+    assert instruction_length(b'') is None
+    with pytest.raises(ValueError):
+        instruction_length(b'\xEE')
+
+def test_split_pages():
+    data = job(3)
+    pages = list(split_pages(data))
+    assert len(pages) == 3
+    assert b''.join(pages) == data
+    assert all(bytes(page).endswith(PRINT) for page in pages[:-1])
+    assert bytes(pages[-1]).endswith(PRINT_LAST)
+    ends = [len(pages[0]), len(pages[0]) + len(pages[1]), len(data)]
+    assert list(page_boundaries(data)) == ends
+
+def test_split_pages_trailing_instructions():
+    data = job(1) + INIT
+    pages = list(split_pages(data))
+    assert [bytes(page) for page in pages] == [job(1), INIT]
+
+def status_frame(status_type=0x00, phase_type=0x00, media_width=62, media_type=0x0A, media_length=0, error_1=0, error_2=0):
+    frame = bytearray(32)
+    frame[0:3] = b'\x80\x20\x42'
+    frame[8], frame[9] = error_1, error_2
+    frame[10], frame[11], frame[17] = media_width, media_type, media_length
+    frame[18], frame[19] = status_type, phase_type
+    return bytes(frame)
+
+def test_printer_status():
+    status = PrinterStatus.decode(status_frame(status_type=0x01, phase_type=0x01, media_width=29,
+                                               media_type=0x0B, media_length=90))
+    assert status.status_type == 'Printing completed'
+    assert status.phase_type == 'Printing state'
+    assert status.media_type == 'Die-cut labels'
+    assert (status.media_width, status.media_length) == (29, 90)
+    assert status.errors == ()
+
+def test_printer_status_errors():
+    status = PrinterStatus.decode(status_frame(status_type=0x02, error_1=0x01, error_2=0x01))
+    assert status.status_type == 'Error occurred'
+    assert status.errors == ('No media when printing', 'Replace media error')
+
+def test_printer_status_invalid():
+    with pytest.raises(ValueError):
+        PrinterStatus.decode(status_frame()[:31])
+    with pytest.raises(ValueError):
+        PrinterStatus.decode(b'\x00' * 32)
+
+def test_interpret_response():
+    frame = status_frame(media_width=62)
+    assert interpret_response(frame) == PrinterStatus.decode(frame).to_dict()
+    assert interpret_response(frame)['status_type'] == 'Reply to status request'
+    with pytest.raises(NameError):
+        interpret_response(b'\x00' * 32)